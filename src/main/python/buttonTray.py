@@ -1,5 +1,3 @@
-import csv
-import io
 
 from PySide2.QtWidgets import (
     QApplication,
@@ -36,6 +34,12 @@ from PySide2.QtCore import (
 )
 from PySide2 import QtCore
 
+from database import BUTTONS_CHANGED, RESET
+from worker import PendingWrites
+
+# Height, in px, each row of the tray is given
+BUTTON_HEIGHT = 50
+
 
 class ActionButton(QPushButton):
     def __init__(self, title, parent=None):
@@ -204,6 +208,13 @@ class ButtonRow(QWidget):
         self.setAttribute(QtCore.Qt.WA_StyledBackground, True)
         return
 
+    def setDefinition(self, title, command):
+        if title != self.buttonTitle:
+            self.buttonTitle = title
+            self.actionButton.setText(title)
+        self.command = command
+        return
+
     @Slot()
     def handleDeleteButton(self):
         self.delButtonPressed.emit(self.buttonId)
@@ -234,11 +245,14 @@ class TrayContent(QWidget):
 class ButtonTray(QScrollArea):
     getSelectedCards = Signal(list)
     getCurrentList = Signal(list)
-    buttonPressed = Signal()
 
-    def __init__(self, db, parent=None):
+    def __init__(self, db, worker, refresher, parent=None):
         QScrollArea.__init__(self)
         self.db = db
+        self.worker = worker
+        self.writes = PendingWrites(
+            worker, refresher, self.showButtons, self)
+        self.worker.changesReady.connect(self.onChanges)
         self.setStyleSheet('''
             QScrollArea {
                 background-color: #2e2e2e;
@@ -256,53 +270,81 @@ class ButtonTray(QScrollArea):
         self.editDialog = EditDialog()
         self.editDialog.buttonEditsSaved.connect(self.handleEditChanges)
 
+        # ButtonRow widgets by button ROWID, in the order of the layout
+        self.buttonRows = {}
+        # Stale until the buttons table is read and whenever it changes.
+        # It is read again once the tray's own pending writes have landed.
+        self.writes.stale = True
+        self.content = TrayContent()
+        self.contentLayout = QVBoxLayout()
+        self.additionButton = QPushButton('New Button')
+        self.additionButton.pressed.connect(self.handleAdditionButton)
+        self.contentLayout.addWidget(self.additionButton)
+        self.content.setLayout(self.contentLayout)
+        self.content.setAttribute(QtCore.Qt.WA_StyledBackground, True)
+        self.setWidget(self.content)
         self.showButtons()
-        self.buttons = []
-
-        self.buttonPressed.connect(self.showButtons)
         return
 
     @Slot()
     def showButtons(self):
-        self.content = TrayContent()
-        layout = QVBoxLayout()
-        result = self.db.runCommand('show-buttons')
-        self.buttonRows = []
-        contentHeight = 0
-        buttonHeight = 50
-        with io.StringIO(result) as f:
-            reader = csv.DictReader(f, delimiter='\t')
-            for row in reader:
-                buttonName = row['name']
-                buttonId = int(row['id'])
-                buttonCmd = self.db.runCommand(f'get-button {buttonId}')
-
-                buttonRow = ButtonRow(buttonName, buttonId, buttonCmd)
-                buttonRow.dispatchAction.connect(self.handleActionButton)
-                buttonRow.editButtonPressed.connect(
-                        self.editDialog.showWithText)
-                buttonRow.delButtonPressed.connect(self.handleDeleteButton)
-
-                self.buttonRows.append(buttonRow)
-                layout.addWidget(buttonRow)
-                contentHeight += buttonHeight
-
-        self.additionButton = QPushButton('New Button')
-        self.additionButton.pressed.connect(self.handleAdditionButton)
-        layout.addWidget(self.additionButton)
-        contentHeight += buttonHeight
-
-        self.content.setLayout(layout)
+        '''
+        Brings the rows in line with the buttons table, once it changed.
+        Only rows that were added, removed, renamed or moved are touched.
+        '''
+        if not self.writes.stale:
+            return
+        self.writes.stale = False
+        buttons = self.db.allButtons()
+
+        buttonIds = {button.id for button in buttons}
+        for buttonId in list(self.buttonRows):
+            if buttonId not in buttonIds:
+                buttonRow = self.buttonRows.pop(buttonId)
+                self.contentLayout.removeWidget(buttonRow)
+                buttonRow.deleteLater()
+
+        for position, button in enumerate(buttons):
+            buttonRow = self.buttonRows.get(button.id)
+            if buttonRow is None:
+                buttonRow = self.makeButtonRow(button)
+                self.contentLayout.insertWidget(position, buttonRow)
+                continue
+            buttonRow.setDefinition(button.name, button.command)
+            # Undoes the hide of a delete that did not go through
+            buttonRow.show()
+            if self.contentLayout.indexOf(buttonRow) != position:
+                self.contentLayout.removeWidget(buttonRow)
+                self.contentLayout.insertWidget(position, buttonRow)
+
+        # Keeps the dict in layout order too
+        self.buttonRows = {
+            button.id: self.buttonRows[button.id] for button in buttons}
+        contentHeight = (len(buttons) + 1) * BUTTON_HEIGHT
         self.content.setMinimumSize(220, contentHeight)
-        self.content.setAttribute(QtCore.Qt.WA_StyledBackground, True)
-        self.setWidget(self.content)
+        return
+
+    def makeButtonRow(self, button):
+        buttonRow = ButtonRow(button.name, button.id, button.command)
+        buttonRow.dispatchAction.connect(self.handleActionButton)
+        buttonRow.editButtonPressed.connect(self.editDialog.showWithText)
+        buttonRow.delButtonPressed.connect(self.handleDeleteButton)
+        self.buttonRows[button.id] = buttonRow
+        return buttonRow
+
+    @Slot(object)
+    def onChanges(self, changes):
+        for change in changes:
+            if change.kind in (BUTTONS_CHANGED, RESET):
+                self.writes.stale = True
+        self.writes.requestReload()
         return
 
     @Slot(int)
     def handleDeleteButton(self, buttonId):
-        cmd = f'delete-button {buttonId}'
-        self.db.runCommand(cmd)
-        self.showButtons()
+        if buttonId in self.buttonRows:
+            self.buttonRows[buttonId].hide()
+        self.writes.submit('removeButton', buttonId)
         return
 
 
@@ -313,33 +355,22 @@ class ButtonTray(QScrollArea):
 
     @Slot(int)
     def handleActionButton(self, buttonId):
-        buttonCmd = self.db.runCommand(f'get-button {buttonId}')
+        buttonCmd = self.buttonRows[buttonId].command
         selectedCards = []
         currentList = []
 
         self.getSelectedCards.emit(selectedCards)
         self.getCurrentList.emit(currentList)
 
-        if '$CARD' in buttonCmd:
-            for card in selectedCards:
-                newCmd = str(buttonCmd)
-                newCmd = newCmd.replace('$CARD', str(card))
-                newCmd = newCmd.replace('$LIST', str(currentList[0]))
-                self.db.runCommand(newCmd)
-        else:
-            newCmd = str(buttonCmd)
-            newCmd.replace('$LIST', str(currentList[0]))
-            self.db.runCommand(newCmd)
-        self.buttonPressed.emit()
+        listId = currentList[0] if currentList else None
+        self.writes.submit('runMacro', buttonCmd, selectedCards, listId)
         return
 
     @Slot(str, str, int)
     def handleEditChanges(self, name, command, buttonId):
         if buttonId != -1:
-            command = f'rename-button {buttonId} "{name}" "{command}"'
+            self.writes.submit('updateButton', buttonId, name, command)
         else:
-            command = f'add-button "{name}" "{command}"'
-        self.db.runCommand(command)
-        self.showButtons()
+            self.writes.submit('insertButton', name, command)
         return
 
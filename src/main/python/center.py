@@ -1,5 +1,5 @@
-import io
-import csv
+import array
+import bisect
 import datetime
 
 from PySide2.QtWidgets import (
@@ -26,6 +26,7 @@ from PySide2.QtGui import (
     QStandardItem,
 )
 from PySide2.QtCore import (
+    QAbstractListModel,
     QFile,
     QMimeData,
     QByteArray,
@@ -36,25 +37,81 @@ from PySide2.QtCore import (
     Slot,
 )
 
-from database import decodeFromDB, encodeForDB
+from database import (
+    CARDS_INSERTED,
+    CARDS_MOVED,
+    CARDS_UPDATED,
+    CARDS_DELETED,
+    LISTS_DELETED,
+    RESET,
+)
+from worker import PendingWrites
+
+# Cards read per fetchMore by LazyCardModel
+PAGE_SIZE = 200
 
 
-def getCards(db, listId):
+def getCardRows(db, listId):
+    '''
+    Returns (name, rowid, idx, content, dueDate) for each card in a list
+    '''
     if listId == -1:
         return []
-    result = db.runCommand(f'show-cards {listId}')
-    cards = []
-    with io.StringIO(result) as f:
-        reader = csv.DictReader(f, delimiter='\t')
-        for idx, row in enumerate(reader):
-            card = Card(
-                row['title'],
-                int(row['id']),
-                idx,
-                row['content'],
-                int(row['due']))
-            cards.append(card)
-    return cards
+    return [
+        (card.title, card.id, idx, card.content, card.dueDate)
+        for idx, card in enumerate(db.cardsInList(listId))]
+
+
+def longestIncreasing(values):
+    '''
+    Returns the set of values on a longest strictly increasing
+    subsequence of values
+    '''
+    tails = []
+    tailPositions = []
+    previous = [None] * len(values)
+    for pos, value in enumerate(values):
+        length = bisect.bisect_left(tails, value)
+        if length:
+            previous[pos] = tailPositions[length - 1]
+        if length == len(tails):
+            tails.append(value)
+            tailPositions.append(pos)
+        else:
+            tails[length] = value
+            tailPositions[length] = pos
+
+    result = set()
+    pos = tailPositions[-1] if tailPositions else None
+    while pos is not None:
+        result.add(values[pos])
+        pos = previous[pos]
+    return result
+
+
+def sortChanges(changes, listId):
+    '''
+    Sorts the changes that touch listId into the ids of cards edited in
+    place, the ids of cards deleted, and whether the list may have been
+    reordered, which only a refresh puts right
+    '''
+    updated = set()
+    deleted = set()
+    reordered = False
+    for change in changes:
+        if change.kind == RESET:
+            reordered = True
+        elif change.kind == LISTS_DELETED:
+            reordered = reordered or listId in change.ids
+        elif listId not in change.parentIds:
+            continue
+        elif change.kind == CARDS_UPDATED:
+            updated.update(change.ids)
+        elif change.kind == CARDS_DELETED:
+            deleted.update(change.ids)
+        elif change.kind in (CARDS_INSERTED, CARDS_MOVED):
+            reordered = True
+    return updated - deleted, deleted, reordered
 
 
 def toLocalTime(sec):
@@ -63,24 +120,28 @@ def toLocalTime(sec):
     result = dateInfo.strftime('%A, %d %b %Y')
     return result
 
-# TODO: Create a json serialization of Card, List, and Board
-
 
 class Card(QStandardItem):
     def __init__(self, name, rowid, idx, content, dueDate):
         QStandardItem.__init__(self)
         self.itemType = 'CARD'
-        self.name = decodeFromDB(name)
-        self.content = decodeFromDB(content)
-        self.dueDate = int(dueDate)
         self.rowid = int(rowid)
+        self.setFields(name, idx, content, dueDate)
+
+    def setFields(self, name, idx, content, dueDate):
+        self.name = name
+        self.content = content
+        self.dueDate = int(dueDate)
         suffix = ''
         if self.content:
             suffix += ' *'
         if self.dueDate > 0:
-            dateInfo = datetime.datetime.fromtimestamp(dueDate)
+            dateInfo = datetime.datetime.fromtimestamp(self.dueDate)
             suffix += f" (Due: {dateInfo.strftime('%A, %d %b %Y')})"
-        self.setText(self.name + suffix)
+        text = self.name + suffix
+        # Only a changed text costs the view a dataChanged repaint
+        if text != self.text():
+            self.setText(text)
         self.idx = int(idx)
 
     def __str__(self):
@@ -107,7 +168,7 @@ class CardView(QListView):
         self.setWordWrap(True)
         self.setDragDropMode(QAbstractItemView.DragDrop)
         self.doubleClicked.connect(self.onDoubleClick)
-        self.scrollValue = 0
+        self.selectedIndex = -1
         return
 
     @Slot(QModelIndex)
@@ -120,63 +181,149 @@ class CardView(QListView):
     def selectedCards(self, cardList):
         indexes = self.selectedIndexes()
         for idx in indexes:
-            cardModel = self.model().itemFromIndex(idx)
-            cardId = cardModel.rowid
+            cardId = self.model().rowidFromIndex(idx)
             cardList.append(cardId)
         return
 
+    @Slot(int)
+    def selectCard(self, cardId):
+        # Only looks at loaded rows, LazyCardModel may not have it yet
+        model = self.model()
+        for row in range(model.rowCount()):
+            index = model.index(row, 0)
+            if model.rowidFromIndex(index) == cardId:
+                self.setCurrentIndex(index)
+                self.scrollTo(index)
+                break
+        return
+
 
     @Slot()
     def storeSelectedIndex(self):
-        value = self.selectedIndexes()[0].row()
-        self.selectedIndex = value
+        indexes = self.selectedIndexes()
+        self.selectedIndex = indexes[0].row() if indexes else -1
 
     @Slot()
     def restoreSelectedIndex(self):
+        # Selections survive a refresh, this only moves the cursor on
+        # when the selected card itself went away
         model = self.model()
         maxIdx = model.rowCount() - 1
-        if maxIdx == -1:
+        if maxIdx == -1 or self.selectedIndex == -1:
+            return
+        if self.selectedIndexes():
             return
         newIdx = min(self.selectedIndex, maxIdx)
         rowIdx = model.index(newIdx, 0)
         self.setCurrentIndex(rowIdx)
 
-    @Slot()
-    def storeScrollValue(self):
-        value = self.verticalScrollBar().value()
-        self.scrollValue = value
-
-    @Slot()
-    def restoreScrollValue(self):
-        self.verticalScrollBar().setValue(self.scrollValue)
-
 
 class CardModel(QStandardItemModel):
     willUpdateCurrentList = Signal()
     updatedCurrentList = Signal()
 
-    def __init__(self, db):
+    def __init__(self, db, worker, refresher):
         QStandardItemModel.__init__(self, parent=None)
         self.db = db
+        self.worker = worker
+        self.writes = PendingWrites(worker, refresher, self.refresh, self)
+        self.worker.changesReady.connect(self.onChanges)
         self.listId = -1
         self.changedList = False
         return
 
+    @Slot(object)
+    def onChanges(self, changes):
+        '''
+        Applies what a write changed in the current list. Edits and
+        deletes are done in place, anything else refreshes the list.
+        '''
+        updated, deleted, reordered = sortChanges(changes, self.listId)
+        if reordered:
+            self.writes.stale = True
+        elif deleted or updated:
+            self.willUpdateCurrentList.emit()
+            self.removeCards(deleted)
+            self.updateCards(updated)
+            self.updatedCurrentList.emit()
+        self.writes.requestReload()
+        return
+
+    def removeCards(self, cardIds):
+        for rowNum in reversed(range(self.rowCount())):
+            if self.item(rowNum).rowid in cardIds:
+                self.removeRow(rowNum)
+        # Rows run highest idx first
+        lastRow = self.rowCount() - 1
+        for rowNum in range(self.rowCount()):
+            self.item(rowNum).idx = lastRow - rowNum
+        return
+
+    def updateCards(self, cardIds):
+        if not cardIds:
+            return
+        rows = {row.id: row for row in self.db.cards(cardIds)}
+        for rowNum in range(self.rowCount()):
+            card = self.item(rowNum)
+            row = rows.get(card.rowid)
+            if row is not None:
+                card.setFields(row.title, card.idx, row.content, row.dueDate)
+        return
+
     @Slot()
     def refresh(self):
-        if not self.changedList:
+        changedList = self.changedList
+        if changedList:
+            # Nothing of the new list is shown yet, so nothing to undo
+            self.writes.stale = False
+            self.clear()
+        elif self.writes.holdReload():
+            return
+        else:
             self.willUpdateCurrentList.emit()
-        self.clear()
         try:
-            for card in reversed(getCards(self.db, self.listId)):
-                self.appendRow(card)
+            rows = list(reversed(getCardRows(self.db, self.listId)))
         except TypeError:
-            pass
-        if not self.changedList:
+            rows = []
+        self.applyRows(rows)
+        if not changedList:
             self.updatedCurrentList.emit()
         self.changedList = False
         return
-    
+
+    def applyRows(self, rows):
+        '''
+        Brings the model in line with rows, keyed on card rowid. Existing
+        Card items are reused and only the rows that were added, removed,
+        moved or edited are touched, so selections and scrolling survive.
+        '''
+        wanted = {row[1] for row in rows}
+        for rowNum in reversed(range(self.rowCount())):
+            if self.item(rowNum).rowid not in wanted:
+                self.removeRow(rowNum)
+
+        # Cards on the longest run that is already in order stay put,
+        # the rest are taken out and put back at their new rows
+        oldRows = {self.item(r).rowid: r for r in range(self.rowCount())}
+        order = [oldRows[row[1]] for row in rows if row[1] in oldRows]
+        staying = longestIncreasing(order)
+        moving = {}
+        for rowNum in reversed(range(self.rowCount())):
+            if rowNum not in staying:
+                card = self.takeRow(rowNum)[0]
+                moving[card.rowid] = card
+
+        for rowNum, (name, rowid, idx, content, dueDate) in enumerate(rows):
+            card = self.item(rowNum)
+            if card is None or card.rowid != rowid:
+                if rowid in moving:
+                    card = moving.pop(rowid)
+                else:
+                    card = Card(name, rowid, idx, content, dueDate)
+                self.insertRow(rowNum, card)
+            card.setFields(name, idx, content, dueDate)
+        return
+
     @Slot(int)
     def showListCards(self, listId):
         self.changedList = True
@@ -189,6 +336,9 @@ class CardModel(QStandardItemModel):
         listidContainer.append(self.listId)
         return
 
+    def rowidFromIndex(self, index):
+        return self.itemFromIndex(index).rowid
+
     def dropMimeData(self, data, action, row, column, parent):
         result = False
         if 'CARD' in data.text():
@@ -204,9 +354,13 @@ class CardModel(QStandardItemModel):
             else:
                 newIdx = row - 1
 
-            cmd = f'shift-card {cardId} to {newIdx}'
-            self.db.runCommand(cmd)
-            self.refresh()
+            # Rows run highest idx first
+            lastRow = self.rowCount() - 1
+            card = self.takeRow(lastRow - cardIdx)[0]
+            self.insertRow(lastRow - newIdx, card)
+            for rowNum in range(self.rowCount()):
+                self.item(rowNum).idx = lastRow - rowNum
+            self.writes.submit('placeCard', cardId, newIdx)
             result = True
         return result
 
@@ -224,16 +378,266 @@ class CardModel(QStandardItemModel):
     def mimeTypes(self):
         return ['text/plain']
 
+    @Slot(str, int)
+    def addCard(self, title, listId):
+        self.writes.submit('insertCard', title, listId)
+        return
+
     @Slot()
     def onCardEdited(self, title, content, dueDate, cardId):
-        title = encodeForDB(title)
-        content = encodeForDB(content)
-        self.db.runCommand(f'rename-card {cardId} "{title}"')
-        self.db.runCommand(f'set-card-content {cardId} "{content}"')
-        self.db.runCommand(f'set-due-date {cardId} {dueDate}')
+        for rowNum in range(self.rowCount()):
+            card = self.item(rowNum)
+            if card.rowid == cardId:
+                card.setFields(title, card.idx, content, dueDate)
+        self.writes.submit('updateCard', cardId, title, content, dueDate)
+        return
+
+
+class LazyCardModel(QAbstractListModel):
+    '''
+    Drop-in replacement for CardModel meant for very long lists. Only
+    rowid, idx, due date and title are held, in parallel arrays, and
+    cards are read a page at a time as the view scrolls down.
+    '''
+    willUpdateCurrentList = Signal()
+    updatedCurrentList = Signal()
+
+    def __init__(self, db, worker, refresher):
+        QAbstractListModel.__init__(self, parent=None)
+        self.db = db
+        self.worker = worker
+        self.writes = PendingWrites(worker, refresher, self.refresh, self)
+        self.worker.changesReady.connect(self.onChanges)
+        self.listId = -1
+        self.changedList = False
+        self.total = 0
+        self.clearRows()
+        return
+
+    def clearRows(self):
+        self.rowids = array.array('q')
+        self.idxs = array.array('q')
+        self.dueDates = array.array('q')
+        self.hasContent = array.array('b')
+        self.titles = []
+        # Set once a row is moved ahead of the database, see canFetchMore
+        self.reordered = False
+        return
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rowids)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        row = index.row()
+        suffix = ''
+        if self.hasContent[row]:
+            suffix += ' *'
+        if self.dueDates[row] > 0:
+            suffix += f' (Due: {toLocalTime(self.dueDates[row])})'
+        return self.titles[row] + suffix
+
+    def flags(self, index):
+        flags = QAbstractListModel.flags(self, index)
+        if index.isValid():
+            return flags | Qt.ItemIsDragEnabled
+        return flags | Qt.ItemIsDropEnabled
+
+    def canFetchMore(self, parent):
+        if parent.isValid():
+            return False
+        # An optimistic move leaves idxs out of order, so no paging from
+        # them until the list is read again. Writes to other lists, or
+        # pending while another list was shown, do not hold paging up.
+        if self.reordered:
+            return False
+        return len(self.rowids) < self.total
+
+    @Slot(object)
+    def onChanges(self, changes):
+        '''
+        Applies what a write changed in the current list. Edits and
+        deletes of loaded rows are done in place, anything else refreshes.
+        '''
+        updated, deleted, reordered = sortChanges(changes, self.listId)
+        if reordered:
+            self.writes.stale = True
+        elif deleted or updated:
+            self.removeCards(deleted)
+            self.updateCards(updated)
+        self.writes.requestReload()
+        return
+
+    def removeCards(self, cardIds):
+        if not cardIds:
+            return
+        for row in reversed(range(len(self.rowids))):
+            if self.rowids[row] in cardIds:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                for values in (self.rowids, self.idxs, self.dueDates,
+                               self.hasContent, self.titles):
+                    del values[row]
+                self.endRemoveRows()
+        # Some of them may not have been read in yet
+        self.total = self.db.countCards(self.listId)
+        return
+
+    def updateCards(self, cardIds):
+        loaded = [cardId for cardId in cardIds if cardId in self.rowids]
+        for card in self.db.cards(loaded):
+            row = self.rowids.index(card.id)
+            self.titles[row] = card.title
+            self.dueDates[row] = card.dueDate
+            self.hasContent[row] = bool(card.content)
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+        return
+
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        before = None
+        if self.rowids:
+            before = (self.idxs[-1], self.rowids[-1])
+        page = self.db.cardPage(self.listId, PAGE_SIZE, before)
+        if not page:
+            # The list shrank since it was counted
+            self.total = len(self.rowids)
+            return
+
+        first = len(self.rowids)
+        self.beginInsertRows(QModelIndex(), first, first + len(page) - 1)
+        for rowid, idx, dueDate, title, hasContent in page:
+            self.rowids.append(rowid)
+            self.idxs.append(idx)
+            self.dueDates.append(dueDate)
+            self.hasContent.append(hasContent)
+            self.titles.append(title)
+        self.endInsertRows()
+        return
+
+    @Slot()
+    def refresh(self):
+        if self.changedList:
+            self.writes.stale = False
+            loaded = 0
+        elif self.writes.holdReload():
+            return
+        else:
+            self.willUpdateCurrentList.emit()
+            loaded = len(self.rowids)
+
+        self.beginResetModel()
+        self.clearRows()
+        self.total = self.db.countCards(self.listId)
+        self.endResetModel()
+
+        # Read back as many cards as were showing so the view keeps its place
+        while len(self.rowids) < max(loaded, 1) and self.total:
+            if not self.canFetchMore(QModelIndex()):
+                break
+            self.fetchMore(QModelIndex())
+
+        if not self.changedList:
+            self.updatedCurrentList.emit()
+        self.changedList = False
+        return
+
+    @Slot(int)
+    def showListCards(self, listId):
+        self.changedList = True
+        self.listId = listId
         self.refresh()
         return
 
+    @Slot(list)
+    def currentList(self, listidContainer):
+        listidContainer.append(self.listId)
+        return
+
+    def position(self, row):
+        # Rows are shown highest idx first, shift-card counts from the lowest
+        return self.total - 1 - row
+
+    def rowidFromIndex(self, index):
+        return self.rowids[index.row()]
+
+    def itemFromIndex(self, index):
+        if not index.isValid():
+            return None
+        row = index.row()
+        rowid = self.rowids[row]
+        return Card(
+            self.titles[row],
+            rowid,
+            self.position(row),
+            self.db.card(rowid).content,
+            self.dueDates[row])
+
+    def dropMimeData(self, data, action, row, column, parent):
+        result = False
+        if 'CARD' in data.text():
+            _, cardId, cardIdx, _ = data.text().split('::')
+            cardId, cardIdx = int(cardId), int(cardIdx)
+            dropRow = row
+            row = self.total - row
+
+            if row == cardIdx or (row - 1) == cardIdx:
+                return True
+
+            if cardIdx > row:
+                newIdx = row
+            else:
+                newIdx = row - 1
+
+            fromRow = self.total - 1 - cardIdx
+            toRow = self.total - 1 - newIdx
+            self.beginMoveRows(
+                QModelIndex(), fromRow, fromRow, QModelIndex(), dropRow)
+            for values in (self.rowids, self.idxs, self.dueDates,
+                           self.hasContent, self.titles):
+                values.insert(toRow, values.pop(fromRow))
+            self.endMoveRows()
+            self.reordered = True
+            self.writes.submit('placeCard', cardId, newIdx)
+            result = True
+        return result
+
+    def canDropMimeData(self, data, action, row, col, parent):
+        isCard = 'CARD' in data.text()
+        isBetweenCards = (row != -1 and not parent.isValid())
+        return (isCard and isBetweenCards)
+
+    def mimeData(self, indexes):
+        result = QMimeData()
+        row = indexes[0].row()
+        text = f'CARD::{self.rowids[row]}::{self.position(row)}'
+        result.setText(f'{text}::{self.titles[row]}')
+        return result
+
+    def mimeTypes(self):
+        return ['text/plain']
+
+    @Slot(str, int)
+    def addCard(self, title, listId):
+        self.writes.submit('insertCard', title, listId)
+        return
+
+    @Slot()
+    def onCardEdited(self, title, content, dueDate, cardId):
+        if cardId in self.rowids:
+            row = self.rowids.index(cardId)
+            self.titles[row] = title
+            self.dueDates[row] = dueDate
+            self.hasContent[row] = bool(content)
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+        self.writes.submit('updateCard', cardId, title, content, dueDate)
+        return
+
 
 class CardEditWidget(QDialog):
     cardEdited = Signal(str, str, int, int)  # (name, content, dueDate, id)
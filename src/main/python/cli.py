@@ -1,9 +1,48 @@
-from database import Database
+import sys
+
+from database import Database, escapeText
 
 if __name__ == '__main__':
-    db = Database()
+    profile = 'readonly' if '--readonly' in sys.argv else 'safe'
+    # --stats times every command, for the stats command to report
+    stats = '--stats' in sys.argv
+    # --slow=MS logs every statement running at least MS ms, with its plan
+    slowQueryMs = None
+    for arg in sys.argv:
+        if arg.startswith('--slow='):
+            slowQueryMs = float(arg.split('=', 1)[1])
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+
+    # python cli.py export|import FILE runs just that and exits
+    if len(args) == 2 and args[0] in ('export', 'import'):
+        db = Database(
+            profile=profile, stats=stats, slowQueryMs=slowQueryMs)
+        print(db.runCommand(f'{args[0]} "{escapeText(args[1])}"'))
+        if stats:
+            print(db.runCommand('stats'))
+        db.close()
+        sys.exit()
+
+    # python cli.py run-due-cards keeps running the due rule as cards
+    # come due, without the GUI
+    if args == ['run-due-cards']:
+        db = Database(
+            profile=profile, stats=stats, slowQueryMs=slowQueryMs)
+        db.runDueCards()
+        try:
+            db.scheduler.run()
+        except KeyboardInterrupt:
+            pass
+        db.close()
+        sys.exit()
+
+    db = Database(profile=profile, stats=stats, slowQueryMs=slowQueryMs)
     while True:
-        command = input(f'({db.runCommand("where")})> ')
+        try:
+            boardName = db.runCommand('where')
+        except ValueError:
+            boardName = ''
+        command = input(f'({boardName})> ')
         if command == 'exit':
             break
         try:
@@ -1,37 +1,475 @@
+import collections
+import contextlib
+import functools
 import json
 import re
 import sqlite3
 import os
 import time
+
+import profiler
+import querylog
+import scheduler
+import transfer
 # TODO: Add support for letter hash ids
 
-S_QUOTE = "'"
 D_QUOTE = '"'
 
-
-def encodeForDB(content):
-    content = content.replace('\t', ' '*4)
-    content = content.replace('\n', '<|NEWLINE|>')
-    content = content.replace(S_QUOTE, S_QUOTE*2)
-    return content
-
-
-def decodeFromDB(content):
-    content = content.replace('<|NEWLINE|>', '\n')
-    content = content.replace(S_QUOTE*2, S_QUOTE)
-    return content
+# TSV command output escapes these; command arguments are read back the
+# same way, anything else after a backslash is left alone
+UNESCAPES = {'\\': '\\', 't': '\t', 'n': '\n', 'r': '\r'}
+UNESCAPE_PAT = re.compile(r'\\(.)')
+
+# Spacing between the idx of neighbouring rows. Moving a row takes the
+# midpoint of its new neighbours; a sibling group is only renumbered once
+# two neighbours end up adjacent.
+IDX_GAP = 1024
+
+# Parsed command plans kept by parseCommand, keyed by the command string
+PLAN_CACHE_SIZE = 1024
+
+# Argument group holding the card of each verb runMacro can run over a
+# whole selection as one statement
+BULK_CARD_GROUPS = {
+    'delete-card': 'cardId',
+    'move-card': 'cardStr',
+    'set-due-date': 1,
+    'set-due-in': 1,
+}
+
+# Seconds per unit of a set-due-in interval
+DUE_IN_UNITS = {
+    'd': 24*60*60,
+    'w': 24*60*60*7,
+    'm': 24*60*60*30,
+    'y': 24*60*60*365,
+}
+
+# Kinds of Change a Database publishes once a transaction commits. ids
+# are the rows the change is about; parentIds the lists (for cards) or
+# boards (for lists) they were in or went to.
+CARDS_INSERTED = 'cards-inserted'
+CARDS_MOVED = 'cards-moved'
+CARDS_UPDATED = 'cards-updated'
+CARDS_DELETED = 'cards-deleted'
+LISTS_INSERTED = 'lists-inserted'
+LISTS_RENAMED = 'lists-renamed'
+LISTS_MOVED = 'lists-moved'
+LISTS_DELETED = 'lists-deleted'
+BOARDS_INSERTED = 'boards-inserted'
+BOARDS_RENAMED = 'boards-renamed'
+BOARDS_MOVED = 'boards-moved'
+BOARDS_DELETED = 'boards-deleted'
+BUTTONS_CHANGED = 'buttons-changed'
+# Anything may have changed, e.g. after an import
+RESET = 'reset'
+
+# Hits per page of search-cards
+SEARCH_PAGE_SIZE = 50
+
+# Matches, newest first, that searchCards ranks against each other. A
+# search with at most this many matches ranks all of them. Ranking every
+# match of a common word would cost seconds on a big database, one with
+# more is ranked a window at a time. A multiple of SEARCH_PAGE_SIZE, so no
+# page takes rows from two windows.
+SEARCH_RANK_WINDOW = 5000
+
+# Cards inserted per executemany call by importRecords
+IMPORT_CHUNK_SIZE = 5000
+
+# Prepared statements the connection keeps, keyed by SQL text. Every
+# query has a fixed text with bound values, so this only has to hold
+# one entry per distinct statement.
+STATEMENT_CACHE_SIZE = 512
+
+# Connection pragmas applied by each Database profile. WAL lets the GUI
+# and the cli read while the other one is writing; busy_timeout is in ms,
+# a negative cache_size is in KiB.
+PROFILES = {
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    'safe': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -16384,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 10000,
+    },
+    'readonly': {
+        'query_only': 'ON',
+        'cache_size': -65536,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+
+# Argument grammar of every command, keyed by its verb
+GRAMMAR = {
+    'where': r'where',
+    'goto': r'goto (?P<boardStr>".+"|\d+)',
+
+    'add-card': r'add-card "(.*)":"(.*)":([\d-]*) to (".*"|.*)',
+    'add-list': r'add-list "(.*)" to (\d*)',
+    'add-board': r'add-board "(.*)"',
+    'add-button': r'add-button "(.*)" "(.*)"',
+
+    'set-card-content': r'set-card-content (\d*) "(.*)"',
+    'get-card-content': r'get-card-content (\d*)',
+
+    'set-due-date': r'set-due-date (\d+) (\d+|-1)',
+    'get-due-date': r'get-due-date (\d*)',
+    'set-due-in': r'set-due-in (\d+) (\d+d|\d+w|\d+m|\d+y)',
+    'move-due-cards': r'move-due-cards ([\d,]+) to (\d+)',
+    'set-due-rule': r'set-due-rule "(.*)"',
+    'get-due-rule': r'get-due-rule',
+    'run-due-cards': r'run-due-cards',
+
+    'reindex': r'reindex',
+    'repair-orphans': r'repair-orphans',
+    'show-settings': r'show-settings',
+    'show-statement-cache': r'show-statement-cache',
+    'stats': r'stats(?: (reset|json))?',
+
+    'search-cards': r'search-cards "(.*)"(?: page (\d+))?',
+
+    'export': r'export "(.*)"',
+    'import': r'import "(.*)"',
+
+    'show-cards': r'show-cards (".*"|\d*)',
+    'show-lists': r'show-lists(?: (".*"|\d*))?',
+    'show-boards': r'show-boards',
+    'show-tree': r'show-tree',
+    'show-buttons': r'show-buttons',
+
+    'get-button': r'get-button (\d*)',
+
+    'rename-button': r'rename-button (\d*) "(.*)" "(.*)"',
+    'rename-board': r'rename-board (\d*) "(.*)"',
+    'rename-list': r'rename-list (\d*) "(.*)"',
+    'rename-card': r'rename-card (\d*) "(.*)"',
+
+    'move-card': (r'move-card (?P<cardStr>".+"|\d+)'
+                  r' to (?P<listDstStr>".+"|\d+|next|prev)'
+                  r'(?: in (?P<boardStr>".+"|\d+))?'),
+    'move-list': (r'move-list (?P<listStr>".+"|\d+)'
+                  r' to (?P<boardStr>".+"|\d+)'),
+
+    'shift-card': r'shift-card (\d+) to (\d+|-\d+)',
+    'shift-list': r'shift-list (\d+) to (\d+|-\d+)',
+    'shift-board': r'shift-board (\d+) to (\d+|-\d+)',
+
+    'delete-card': r'delete-card (?P<cardId>\d+)',
+    'delete-list': r'delete-list (?P<listId>\d+)',
+    'delete-board': r'delete-board (?P<boardId>\d+)',
+    'delete-button': r'delete-button (\d*)',
+}
+GRAMMAR = {verb: re.compile(pat) for verb, pat in GRAMMAR.items()}
+
+# Schema changes in the order they were introduced. PRAGMA user_version
+# holds the number of migrations already applied to a db file.
+MIGRATIONS = [
+    # 1: Ordering and lookup indexes
+    '''
+    CREATE INDEX IF NOT EXISTS cardsByList ON cards(list, idx);
+    CREATE INDEX IF NOT EXISTS cardsByDueDate ON cards(dueDate);
+    CREATE INDEX IF NOT EXISTS listsByBoard ON lists(board, idx);
+    CREATE INDEX IF NOT EXISTS boardsByIdx ON boards(idx);
+    CREATE INDEX IF NOT EXISTS buttonsByIdx ON buttons(idx);
+    ''',
+    # 2: Spread the dense 0..n orderings out by IDX_GAP
+    f'''
+    UPDATE cards SET idx = idx * {IDX_GAP};
+    UPDATE lists SET idx = idx * {IDX_GAP};
+    UPDATE boards SET idx = idx * {IDX_GAP};
+    UPDATE buttons SET idx = idx * {IDX_GAP};
+    ''',
+    # 3: Store text raw, newlines used to be kept as <|NEWLINE|>
+    '''
+    UPDATE cards
+    SET title = REPLACE(title, '<|NEWLINE|>', char(10)),
+        content = REPLACE(content, '<|NEWLINE|>', char(10))
+    WHERE instr(title, '<|NEWLINE|>') OR instr(content, '<|NEWLINE|>');
+    UPDATE lists SET title = REPLACE(title, '<|NEWLINE|>', char(10))
+    WHERE instr(title, '<|NEWLINE|>');
+    UPDATE boards SET title = REPLACE(title, '<|NEWLINE|>', char(10))
+    WHERE instr(title, '<|NEWLINE|>');
+    UPDATE buttons
+    SET name = REPLACE(name, '<|NEWLINE|>', char(10)),
+        command = REPLACE(command, '<|NEWLINE|>', char(10))
+    WHERE instr(name, '<|NEWLINE|>') OR instr(command, '<|NEWLINE|>');
+    ''',
+    # 4: Full-text index over card titles and content, kept in step with
+    # cards by triggers. 2 and 3 character prefixes get index entries of
+    # their own so short search-as-you-type prefixes stay cheap.
+    '''
+    CREATE VIRTUAL TABLE cardsSearch USING fts5(
+        title, content, content='cards', content_rowid='rowid',
+        prefix='2 3');
+    CREATE TRIGGER cardsSearchInsert AFTER INSERT ON cards BEGIN
+        INSERT INTO cardsSearch(rowid, title, content)
+        VALUES (new.rowid, new.title, new.content);
+    END;
+    CREATE TRIGGER cardsSearchDelete AFTER DELETE ON cards BEGIN
+        INSERT INTO cardsSearch(cardsSearch, rowid, title, content)
+        VALUES ('delete', old.rowid, old.title, old.content);
+    END;
+    CREATE TRIGGER cardsSearchUpdate AFTER UPDATE OF title, content ON cards
+    WHEN old.title IS NOT new.title OR old.content IS NOT new.content
+    BEGIN
+        INSERT INTO cardsSearch(cardsSearch, rowid, title, content)
+        VALUES ('delete', old.rowid, old.title, old.content);
+        INSERT INTO cardsSearch(rowid, title, content)
+        VALUES (new.rowid, new.title, new.content);
+    END;
+    INSERT INTO cardsSearch(cardsSearch) VALUES ('rebuild');
+    ''',
+    # 5: Named values kept with the data, e.g. the due rule
+    '''
+    CREATE TABLE settings (name text PRIMARY KEY, value);
+    ''',
+    # 6: Rebuild the tables around INTEGER PRIMARY KEY ids, keeping every
+    # ROWID, with lists and cards deleted along with their parent. Orphans
+    # are copied as they are, repair-orphans removes them.
+    '''
+    ALTER TABLE boards RENAME TO oldBoards;
+    ALTER TABLE lists RENAME TO oldLists;
+    ALTER TABLE cards RENAME TO oldCards;
+    ALTER TABLE buttons RENAME TO oldButtons;
+
+    CREATE TABLE boards (id integer PRIMARY KEY, title text, idx integer);
+    CREATE TABLE lists
+        (id integer PRIMARY KEY,
+         title text,
+         idx integer,
+         board integer REFERENCES boards(id) ON DELETE CASCADE);
+    CREATE TABLE cards
+        (id integer PRIMARY KEY,
+         title text,
+         idx integer,
+         dueDate integer,
+         list integer REFERENCES lists(id) ON DELETE CASCADE,
+         content text);
+    CREATE TABLE buttons
+        (id integer PRIMARY KEY, name text, command text, idx integer);
+
+    INSERT INTO boards SELECT ROWID, title, idx FROM oldBoards;
+    INSERT INTO lists SELECT ROWID, title, idx, board FROM oldLists;
+    INSERT INTO cards
+    SELECT ROWID, title, idx, dueDate, list, content FROM oldCards;
+    INSERT INTO buttons SELECT ROWID, name, command, idx FROM oldButtons;
+
+    DROP TABLE oldBoards;
+    DROP TABLE oldLists;
+    DROP TABLE oldCards;
+    DROP TABLE oldButtons;
+
+    CREATE INDEX cardsByList ON cards(list, idx);
+    CREATE INDEX cardsByDueDate ON cards(dueDate);
+    CREATE INDEX listsByBoard ON lists(board, idx);
+    CREATE INDEX boardsByIdx ON boards(idx);
+    CREATE INDEX buttonsByIdx ON buttons(idx);
+
+    CREATE TRIGGER cardsSearchInsert AFTER INSERT ON cards BEGIN
+        INSERT INTO cardsSearch(rowid, title, content)
+        VALUES (new.rowid, new.title, new.content);
+    END;
+    CREATE TRIGGER cardsSearchDelete AFTER DELETE ON cards BEGIN
+        INSERT INTO cardsSearch(cardsSearch, rowid, title, content)
+        VALUES ('delete', old.rowid, old.title, old.content);
+    END;
+    CREATE TRIGGER cardsSearchUpdate AFTER UPDATE OF title, content ON cards
+    WHEN old.title IS NOT new.title OR old.content IS NOT new.content
+    BEGIN
+        INSERT INTO cardsSearch(cardsSearch, rowid, title, content)
+        VALUES ('delete', old.rowid, old.title, old.content);
+        INSERT INTO cardsSearch(rowid, title, content)
+        VALUES (new.rowid, new.title, new.content);
+    END;
+    ''',
+]
+
+
+CardRow = collections.namedtuple('CardRow', 'id title dueDate content')
+ListRow = collections.namedtuple('ListRow', 'id title cardCount')
+BoardRow = collections.namedtuple('BoardRow', 'id title')
+ButtonRow = collections.namedtuple('ButtonRow', 'id name command')
+TreeRow = collections.namedtuple(
+    'TreeRow', 'boardId boardTitle listId listTitle cardCount')
+SearchRow = collections.namedtuple(
+    'SearchRow', 'cardId title listId listTitle boardId boardTitle')
+Change = collections.namedtuple('Change', 'kind ids parentIds')
+
+
+def escapeText(text):
+    '''
+    Backslash escapes the characters that would break a TSV field
+    '''
+    # Chained replaces run several times faster than str.translate
+    text = text.replace('\\', '\\\\')
+    text = text.replace('\t', '\\t')
+    text = text.replace('\n', '\\n')
+    return text.replace('\r', '\\r')
+
+
+def unescapeText(text):
+    '''
+    Reads a command argument written the way escapeText writes fields
+    '''
+    if '\\' not in text:
+        return text
+    return UNESCAPE_PAT.sub(
+        lambda m: UNESCAPES.get(m.group(1), m.group(0)), text)
+
+
+def searchQuery(text):
+    '''
+    FTS5 query matching cards that contain every word of text, the last
+    one as a prefix so results show up while it is still being typed.
+    A single letter is too broad a prefix and is matched as a word.
+    '''
+    words = [word.replace(D_QUOTE, D_QUOTE * 2) for word in text.split()]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if len(words[-1]) > 1:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def formatTable(header, rows):
+    '''
+    Tab separated command output, one line per row
+    '''
+    lines = ['\t'.join(header)]
+    lines += [
+        '\t'.join(
+            escapeText(value) if isinstance(value, str) else str(value)
+            for value in row)
+        for row in rows]
+    return '\n'.join(lines) + '\n'
+
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def parseCommand(cmd):
+    '''
+    Splits a command into its verb and the match of its arguments.
+    Dispatch is on the whole first token, so verbs sharing a prefix
+    (move-card, move-due-cards) never shadow each other.
+    '''
+    verb = cmd.split(' ', 1)[0]
+    if verb not in GRAMMAR:
+        raise ValueError(f'Unknown command: {verb}')
+
+    match = GRAMMAR[verb].match(cmd)
+    if match is None:
+        raise ValueError(f'Invalid arguments for {verb}: {cmd}')
+    return verb, match
+
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def parseMacro(cmd):
+    '''
+    Parses a button command with one $CARD in it, when $CARD is the card
+    argument of a verb in BULK_CARD_GROUPS. Returns (verb, match), the
+    match read with $CARD as 0, or None when the command has to run card
+    by card.
+    '''
+    if cmd.count('$CARD') != 1:
+        return None
+    verb, match = parseCommand(cmd.replace('$CARD', '0'))
+    group = BULK_CARD_GROUPS.get(verb)
+    if group is None or match.start(group) != cmd.index('$CARD'):
+        return None
+    return verb, match
+
+
+def moveStep(match):
+    '''
+    1 for a move-card to next, -1 to prev, 0 to a named list
+    '''
+    listDstStr = match.group('listDstStr')
+    if 'next' in listDstStr:
+        return 1
+    if 'prev' in listDstStr:
+        return -1
+    return 0
+
+
+def dueDateIn(interval, now=None):
+    '''
+    Timestamp an interval like 12d, 3w, 2m or 1y from now
+    '''
+    if now is None:
+        now = int(time.time())
+    return int(interval[:-1]) * DUE_IN_UNITS[interval[-1]] + now
 
 
 class Database:
-    def __init__(self, filename='data.db'):
+    def __init__(self, filename='data.db', profile='safe', stats=False,
+                 slowQueryMs=None):
+        '''
+        profile is one of PROFILES: 'safe' (WAL, full fsync), 'fast' (WAL,
+        fsync at checkpoints only, bigger cache and mmap) or 'readonly'
+        (the file must already exist and be up to date). stats turns on
+        the per-verb timings the stats command reports. slowQueryMs logs
+        every statement that runs at least that long, see querylog.
+        '''
         self.filename = filename
-        if not os.path.exists(filename):
-            self.db = sqlite3.connect(self.filename)
+        self.profile = profile
+        # Mirror of the connection's LRU statement cache, for its hit rate
+        self.statements = collections.OrderedDict()
+        self.statementHits = 0
+        self.statementMisses = 0
+        # SlowQueryLog on the connection, None unless slowQueryMs is set
+        self.slowLog = None
+        pragmas = PROFILES[profile]
+        timeout = pragmas['busy_timeout'] / 1000
+        if profile == 'readonly':
+            uri = f'file:{filename}?mode=ro'
+            self.db = sqlite3.connect(
+                uri, timeout=timeout, uri=True,
+                cached_statements=STATEMENT_CACHE_SIZE)
+            self.applyPragmas(pragmas)
+        elif not os.path.exists(filename):
+            self.db = sqlite3.connect(
+                self.filename, timeout=timeout,
+                cached_statements=STATEMENT_CACHE_SIZE)
+            self.applyPragmas(pragmas)
             self.initializeDb()
+            self.migrate()
         else:
-            self.db = sqlite3.connect(self.filename)
-
-        self.boardIdx = 0
+            self.db = sqlite3.connect(
+                self.filename, timeout=timeout,
+                cached_statements=STATEMENT_CACHE_SIZE)
+            self.applyPragmas(pragmas)
+            self.migrate()
+        # Off while migrating, the rebuild in migration 6 drops tables
+        self.db.execute('PRAGMA foreign_keys = ON')
+        if slowQueryMs is not None:
+            self.slowLog = querylog.SlowQueryLog(self.db, slowQueryMs)
+
+        # ROWID of the current board, None means the first one
+        self.boardId = None
+        # Board ROWIDs in display order, None until next needed
+        self.boardIds = None
+        self.batchDepth = 0
+        # DueScheduler, created by the first runDueCards
+        self.scheduler = None
+        # CommandProfiler timing runCommand, None unless stats is on
+        self.profiler = profiler.CommandProfiler() if stats else None
+        # ns the last outermost batch took to commit
+        self.commitNs = None
+        # Changes made by the open transaction, and who hears of them
+        self.changes = []
+        self.subscribers = []
 
         self.actions = {
             'where': self.where,
@@ -49,10 +487,25 @@ class Database:
             'get-due-date': self.getDueDate,
             'set-due-in': self.setDueIn,
             'move-due-cards': self.moveDueCards,
+            'set-due-rule': self.setDueRuleCommand,
+            'get-due-rule': self.getDueRuleCommand,
+            'run-due-cards': self.runDueCardsCommand,
+
+            'reindex': self.reindexAll,
+            'repair-orphans': self.repairOrphansCommand,
+            'show-settings': self.showSettings,
+            'show-statement-cache': self.showStatementCache,
+            'stats': self.statsCommand,
+
+            'search-cards': self.searchCardsCommand,
+
+            'export': self.exportTo,
+            'import': self.importFrom,
 
             'show-cards': self.showCards,
             'show-lists': self.showLists,
             'show-boards': self.showBoards,
+            'show-tree': self.showTree,
             'show-buttons': self.showButtons,
 
             'get-button': self.getButton,
@@ -74,11 +527,70 @@ class Database:
             'delete-board': self.delBoard,
             'delete-button': self.delButton,
         }
+        # Handlers of the verbs in BULK_CARD_GROUPS, over a list of cards
+        self.bulkActions = {
+            'delete-card': self.delCards,
+            'move-card': self.moveCards,
+            'set-due-date': self.setDueDates,
+            'set-due-in': self.setDuesIn,
+        }
         return
 
     def close(self):
+        if self.slowLog is not None:
+            self.slowLog.close()
         self.db.close()
 
+    def execute(self, sql, values=()):
+        '''
+        Runs one statement on the connection, counting whether sqlite3
+        could reuse a prepared statement for its text
+        '''
+        if self.slowLog is not None:
+            self.slowLog.nextStatement()
+        if sql in self.statements:
+            self.statements.move_to_end(sql)
+            self.statementHits += 1
+        else:
+            self.statementMisses += 1
+            self.statements[sql] = None
+            if len(self.statements) > STATEMENT_CACHE_SIZE:
+                self.statements.popitem(last=False)
+        if self.slowLog is None:
+            return self.db.execute(sql, values)
+        try:
+            return self.db.execute(sql, values)
+        finally:
+            self.slowLog.stepped()
+
+    def statementCacheStats(self):
+        executed = self.statementHits + self.statementMisses
+        hitRate = self.statementHits / executed if executed else 0.0
+        return {
+            'statements': len(self.statements),
+            'executed': executed,
+            'hits': self.statementHits,
+            'misses': self.statementMisses,
+            'hitRate': round(hitRate, 4),
+        }
+
+    def applyPragmas(self, pragmas):
+        for name, value in pragmas.items():
+            self.db.execute(f'PRAGMA {name} = {value}')
+        return
+
+    def connectionSettings(self):
+        '''
+        The pragmas in effect on the connection, as sqlite reports them
+        '''
+        names = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size',
+                 'temp_store', 'busy_timeout', 'query_only', 'foreign_keys',
+                 'page_size')
+        settings = {'profile': self.profile}
+        for name in names:
+            settings[name] = self.db.execute(f'PRAGMA {name}').fetchone()[0]
+        return settings
+
     def initializeDb(self):
         print('initializing db')
         sqlLines = [
@@ -99,559 +611,1269 @@ class Database:
             "INSERT INTO lists VALUES ('Done', 2, 1)",
         ]
         for sql in sqlLines:
-            self.db.execute(sql)
+            self.execute(sql)
 
         self.db.commit()
         return
 
+    def migrate(self):
+        '''
+        Brings the schema up to date, one transaction per migration
+        '''
+        version = self.execute('PRAGMA user_version').fetchone()[0]
+        for newVersion in range(version + 1, len(MIGRATIONS) + 1):
+            script = MIGRATIONS[newVersion - 1]
+            try:
+                self.db.executescript(f'''
+                    BEGIN;
+                    {script}
+                    PRAGMA user_version = {newVersion};
+                    COMMIT;
+                ''')
+            except sqlite3.Error:
+                if self.db.in_transaction:
+                    self.db.rollback()
+                raise
+        return
+
     def runCommand(self, cmd):
         '''
         Executes a command on the datatree
         '''
-        items = self.actions.items()
-        op = next(func for verb, func in items if cmd.startswith(verb))
-
-        # Run command
-        result = op(cmd)
-        self.db.commit()
+        verb, match = parseCommand(cmd)
+        with self.tracing(verb):
+            if self.profiler is None or verb == 'stats':
+                with self.batch():
+                    result = self.actions[verb](match)
+                return result
+
+            outermost = self.batchDepth == 0
+            changesBefore = self.db.total_changes
+            start = time.perf_counter_ns()
+            with self.batch():
+                result = self.actions[verb](match)
+            elapsed = time.perf_counter_ns() - start
+            # Rows written, counting those written by triggers
+            rows = self.db.total_changes - changesBefore
+            commitNs = self.commitNs if outermost else None
+            self.profiler.record(verb, elapsed, rows, commitNs)
         return result
 
-    def where(self, command):
+    def tracing(self, verb):
+        '''
+        Tags the statements run in the block with verb in the slow
+        query log, when there is one
+        '''
+        if self.slowLog is None:
+            return contextlib.nullcontext()
+        return self.slowLog.running(verb)
+
+    def runCommands(self, cmds):
+        '''
+        Executes several commands in one transaction
+        '''
+        with self.batch():
+            results = [self.runCommand(cmd) for cmd in cmds]
+        return results
+
+    def runMacro(self, cmd, cardIds, listId=None):
+        '''
+        Runs a button command over the selected cards in one transaction.
+        $LIST stands for listId. A command with $CARD in it runs for each
+        of cardIds, as one set-based statement when its verb has a bulk
+        form and card by card otherwise.
+        '''
+        if '$LIST' in cmd:
+            if listId is None:
+                raise ValueError(f'No current list for $LIST: {cmd}')
+            cmd = cmd.replace('$LIST', str(listId))
+
+        with self.batch():
+            if '$CARD' not in cmd:
+                self.runCommand(cmd)
+                return
+            plan = parseMacro(cmd)
+            if plan is not None:
+                verb, match = plan
+                if cardIds:
+                    self.bulkActions[verb](match, list(cardIds))
+                return
+            self.runCommands(
+                [cmd.replace('$CARD', str(cardId)) for cardId in cardIds])
+        return
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''
+        Groups the commands run inside the block into one transaction.
+        Only the outermost batch commits; an exception rolls back all of it.
+        '''
+        self.batchDepth += 1
+        try:
+            yield self
+        except BaseException:
+            if self.batchDepth == 1:
+                self.db.rollback()
+                self.invalidateBoards()
+                self.changes = []
+            raise
+        else:
+            if self.batchDepth == 1:
+                start = time.perf_counter_ns()
+                self.db.commit()
+                self.commitNs = time.perf_counter_ns() - start
+                if self.slowLog is not None:
+                    self.slowLog.stepped()
+                changes, self.changes = self.changes, []
+                if changes:
+                    for callback in self.subscribers:
+                        callback(changes)
+        finally:
+            self.batchDepth -= 1
+
+    def subscribe(self, callback):
+        '''
+        Has callback(changes) called with the list of Change records of
+        each transaction, right after it commits
+        '''
+        self.subscribers.append(callback)
+        return
+
+    def publish(self, kind, ids, parentIds=()):
+        '''
+        Records a Change of the open transaction
+        '''
+        self.changes.append(Change(kind, tuple(ids), tuple(set(parentIds))))
+        return
+
+    def where(self, match):
         '''
         where
         '''
-        sql = 'SELECT title FROM boards ORDER BY idx ASC'
-        result = list(self.db.execute(sql))
-        boardName = result[self.boardIdx][0]
+        sql = 'SELECT title FROM boards WHERE ROWID = ?'
+        boardId = self.getCurrentBoardId()
+        boardName = self.execute(sql, (boardId,)).fetchone()[0]
         return boardName
 
-    def goto(self, command):
+    def goto(self, match):
         '''
         goto 123
         goto "board name"
         '''
-        argPat = r'goto (?P<boardStr>".+"|\d+)'
-        match = re.match(argPat, command)
         boardId = self.getBoardId(match.group('boardStr'))
-        sql = f'''
-            SELECT idx, title FROM boards WHERE ROWID = {boardId}
-        '''
-        idx, title = self.db.execute(sql).fetchone()
-        self.boardIdx = idx
+        sql = 'SELECT title FROM boards WHERE ROWID = ?'
+        title = self.execute(sql, (boardId,)).fetchone()[0]
+        self.invalidateBoards()
+        self.boardId = boardId
         return f'Current board: {title}'
 
     def getAllBoardIds(self):
         sql = 'SELECT ROWID FROM boards'
-        boardIds = [i[0] for i in self.db.execute(sql)]
+        boardIds = [i[0] for i in self.execute(sql)]
         return boardIds 
 
     def getAllListIds(self):
         sql = 'SELECT ROWID FROM lists'
-        listIds = [i[0] for i in self.db.execute(sql)]
+        listIds = [i[0] for i in self.execute(sql)]
         return listIds 
 
-    def cullOrphans(self):
-        boardIds = self.getAllBoardIds()
-        boardIdStr = ','.join(str(bid) for bid in boardIds)
-        boardIdStr = f'({boardIdStr})'
-        sql = f'''
-            DELETE FROM lists
-            WHERE board NOT IN {boardIdStr}
-        '''
-        self.db.execute(sql)
+    def repairOrphans(self):
+        '''
+        Deletes the lists and cards whose parent is gone. Deletes cascade,
+        so this is only needed for files written without foreign keys.
+        Returns how many rows of each table were deleted.
+        '''
+        counts = {'lists': 0, 'cards': 0}
+        with self.batch():
+            # Lists first, their cards then cascade instead of being orphans
+            for table in counts:
+                rows = self.execute(f'PRAGMA foreign_key_check({table})')
+                rowids = [row[1] for row in rows]
+                sql = f'''
+                    DELETE FROM {table}
+                    WHERE ROWID IN (SELECT value FROM json_each(?))
+                '''
+                self.execute(sql, (json.dumps(rowids),))
+                counts[table] = len(rowids)
+        return counts
 
-        listIds = self.getAllListIds()
-        listIdStr = ','.join(str(bid) for bid in listIds)
-        listIdStr = f'({listIdStr})'
-        sql = f'''
-            DELETE FROM cards
-            WHERE list NOT IN {listIdStr}
+    def invalidateBoards(self):
+        '''
+        Drops the cached board order. Called by whatever adds, removes or
+        reorders boards.
         '''
-        self.db.execute(sql)
+        self.boardIds = None
         return
 
+    def getBoardOrder(self):
+        if self.boardIds is None:
+            sql = 'SELECT ROWID FROM boards ORDER BY idx ASC'
+            self.boardIds = [r[0] for r in self.execute(sql)]
+        return self.boardIds
+
     def getCurrentBoardId(self):
         '''
         current-board-id
-        '''
-        sql = 'SELECT ROWID FROM boards ORDER BY idx ASC'
-        boards = list(self.db.execute(sql))
-        boardName = boards[self.boardIdx][0]
-        return boardName
+
+        The first board when none was picked, or when the one picked has
+        since been deleted by another connection
+        '''
+        if self.boardId is not None:
+            sql = 'SELECT 1 FROM boards WHERE ROWID = ?'
+            if self.execute(sql, (self.boardId,)).fetchone() is None:
+                # The board order cached with it is as old
+                self.boardId = None
+                self.invalidateBoards()
+        if self.boardId is None:
+            boardIds = self.getBoardOrder()
+            if not boardIds:
+                raise ValueError('There are no boards')
+            self.boardId = boardIds[0]
+        return self.boardId
 
     def getListId(self, listStr, boardId=-1):
         if boardId == -1:
             boardId = self.getCurrentBoardId()
 
         if D_QUOTE in listStr:
-            listTitle = encodeForDB(listStr.strip(D_QUOTE))
-            sql = f'''
-                SELECT ROWID
-                FROM lists
-                WHERE title='{listTitle}'
-                AND board={boardId}
-            '''
-            listId = self.db.execute(sql).fetchone()[0]
+            listTitle = unescapeText(listStr.strip(D_QUOTE))
+            sql = 'SELECT ROWID FROM lists WHERE title = ? AND board = ?'
+            listId = self.execute(sql, (listTitle, boardId)).fetchone()[0]
         elif listStr.isdigit():
-            sql = f'''
-                SELECT ROWID
-                FROM lists
-                WHERE ROWID={listStr}'''
-            listId = self.db.execute(sql).fetchone()[0]
+            sql = 'SELECT ROWID FROM lists WHERE ROWID = ?'
+            listId = self.execute(sql, (int(listStr),)).fetchone()[0]
         else:
             raise NotImplementedError('Alphabetical ids not supported yet')
         return listId
 
     def getBoardId(self, boardStr):
         if D_QUOTE in boardStr:
-            boardTitle = boardStr.strip(D_QUOTE)
-            sql = f'''
-                SELECT ROWID
-                FROM boards
-                WHERE title='{boardTitle}'
-            '''
-            boardId = self.db.execute(sql).fetchone()[0]
+            boardTitle = unescapeText(boardStr.strip(D_QUOTE))
+            sql = 'SELECT ROWID FROM boards WHERE title = ?'
+            boardId = self.execute(sql, (boardTitle,)).fetchone()[0]
         elif boardStr.isdigit():
-            sql = f'''
-                SELECT ROWID
-                FROM boards
-                WHERE ROWID={boardStr}'''
-            boardId = self.db.execute(sql).fetchone()[0]
+            sql = 'SELECT ROWID FROM boards WHERE ROWID = ?'
+            boardId = self.execute(sql, (int(boardStr),)).fetchone()[0]
         else:
             raise NotImplementedError('Alphabetical ids not supported yet')
         return boardId
 
     def getMaxIdx(self, table, field='', fieldVal=''):
         if field and fieldVal:
-            sql = f'''
-                SELECT MAX(idx)
-                FROM {table}
-                WHERE {field}={fieldVal}
-                '''
+            sql = f'SELECT MAX(idx) FROM {table} WHERE {field} = ?'
+            values = (fieldVal,)
         else:
             sql = f'SELECT MAX(idx) FROM {table}'
-        maxIdx = self.db.execute(sql).fetchone()[0]
+            values = ()
+        maxIdx = self.execute(sql, values).fetchone()[0]
 
         if maxIdx is None:
-            maxIdx = -1
-        newIdx = maxIdx + 1
+            return 0
+        newIdx = maxIdx + IDX_GAP
         return newIdx
 
     def reindex(self, table, field='', fieldVal=''):
+        '''
+        Renumbers rows to evenly spaced idx values in one UPDATE.
+        With a field but no fieldVal every group of siblings sharing
+        that field is renumbered at once.
+        '''
+        partition = f'PARTITION BY {field}' if field else ''
         if field and fieldVal:
-            sql = f'''
-                SELECT ROWID
-                FROM {table}
-                WHERE {field}={fieldVal}
-                ORDER BY idx ASC
-            '''
+            where = f'WHERE {field} = ?'
+            values = (fieldVal,)
         else:
-            sql = f'''
-                SELECT ROWID
+            where = ''
+            values = ()
+
+        sql = f'''
+            UPDATE {table}
+            SET idx = ranked.pos * {IDX_GAP}
+            FROM (
+                SELECT
+                    ROWID AS rowId,
+                    ROW_NUMBER() OVER (
+                        {partition} ORDER BY idx ASC, ROWID ASC) - 1 AS pos
                 FROM {table}
-                ORDER BY idx ASC
-            '''
+                {where}
+            ) AS ranked
+            WHERE {table}.ROWID = ranked.rowId
+        '''
+        self.execute(sql, values)
+        return
 
-        rows = self.db.execute(sql)
-        for idx, row in enumerate(rows):
-            rowId = row[0]
-            sql = f'''
-                UPDATE {table}
-                SET idx = {idx}
-                WHERE ROWID = {rowId}
-            '''
-            self.db.execute(sql)
+    def placeAt(self, table, rowId, position, field='', fieldVal=''):
+        '''
+        Gives a row the idx that puts it at position among its siblings.
+        Only the moved row is written unless its new neighbours have no
+        gap left between them.
+        '''
+        position = max(position, 0)
+        if field:
+            sibling = f'AND {field} = ?'
+            values = (rowId, fieldVal, max(position - 1, 0))
+        else:
+            sibling = ''
+            values = (rowId, max(position - 1, 0))
+        sql = f'''
+            SELECT idx
+            FROM {table}
+            WHERE ROWID != ? {sibling}
+            ORDER BY idx ASC, ROWID ASC
+            LIMIT 2 OFFSET ?
+        '''
+        neighbours = [row[0] for row in self.execute(sql, values)]
+
+        if position == 0:
+            before = None
+            after = neighbours[0] if neighbours else None
+        else:
+            before = neighbours[0] if neighbours else None
+            after = neighbours[1] if len(neighbours) > 1 else None
+
+        if before is None and after is None:
+            newIdx = self.getMaxIdx(table, field, fieldVal)
+        elif before is None:
+            newIdx = after - IDX_GAP
+        elif after is None:
+            newIdx = before + IDX_GAP
+        elif after - before > 1:
+            newIdx = (before + after) // 2
+        else:
+            # Out of room between the neighbours, spread the group out
+            self.reindex(table, field, fieldVal)
+            return self.placeAt(table, rowId, position, field, fieldVal)
+
+        sql = f'UPDATE {table} SET idx = ? WHERE ROWID = ?'
+        self.execute(sql, (newIdx, rowId))
         return
 
-    def addCard(self, command):
+    # Typed API. Titles and content are stored and returned as raw text,
+    # the command handlers further down parse their arguments and call
+    # into these.
+
+    def cardsInList(self, listId):
+        sql = '''
+            SELECT ROWID, title, dueDate, COALESCE(content, '')
+            FROM cards
+            WHERE list = ?
+            ORDER BY idx ASC
         '''
-        add-card "card title":"description":123 to 123
-        add-card "card title":"description":123 to "list title"
+        rows = self.execute(sql, (listId,))
+        return list(map(CardRow._make, rows))
+
+    def card(self, cardId):
+        sql = '''
+            SELECT ROWID, title, dueDate, COALESCE(content, '')
+            FROM cards
+            WHERE ROWID = ?
+        '''
+        row = self.execute(sql, (cardId,)).fetchone()
+        if row is None:
+            return None
+        return CardRow._make(row)
+
+    def cards(self, cardIds):
+        '''
+        CardRows of those of cardIds that exist, in no particular order
+        '''
+        sql = '''
+            SELECT ROWID, title, dueDate, COALESCE(content, '')
+            FROM cards
+            WHERE ROWID IN (SELECT value FROM json_each(?))
+        '''
+        rows = self.execute(sql, (json.dumps(list(cardIds)),))
+        return list(map(CardRow._make, rows))
+
+    def titles(self, table, rowids):
+        '''
+        Maps each of rowids that exists in table to its title
+        '''
+        sql = f'''
+            SELECT ROWID, title
+            FROM {table}
+            WHERE ROWID IN (SELECT value FROM json_each(?))
+        '''
+        return dict(self.execute(sql, (json.dumps(list(rowids)),)))
+
+    def countCards(self, listId):
+        sql = 'SELECT COUNT(*) FROM cards WHERE list = ?'
+        return self.execute(sql, (listId,)).fetchone()[0]
+
+    def cardPage(self, listId, limit, before=None):
         '''
-        # Get card title and list title
-        pat = r'add-card "(.*)":"(.*)":([\d-]*) to (".*"|.*)'
-        match = re.match(pat, command)
-        cardTitle = match.group(1)
-        descStr = match.group(2)
-        dueDate = match.group(3)
-        listStr = match.group(4)
+        Returns up to limit (ROWID, idx, dueDate, title, hasContent) rows
+        of a list, highest idx first. Paging is keyset based: pass the
+        (idx, ROWID) of the last row of the previous page as before.
+        '''
+        if before is None:
+            keyFilter = ''
+            values = (listId, limit)
+        else:
+            keyFilter = 'AND (idx, ROWID) < (?, ?)'
+            values = (listId, *before, limit)
 
-        # Get new index
-        listId = self.getListId(listStr)
-        newIdx = self.getMaxIdx('cards', 'list', listId)
+        sql = f'''
+            SELECT ROWID, idx, dueDate, title, COALESCE(content, '') != ''
+            FROM cards
+            WHERE list = ? {keyFilter}
+            ORDER BY idx DESC, ROWID DESC
+            LIMIT ?
+        '''
+        return self.execute(sql, values).fetchall()
 
-        # Insert list into table
-        values = (cardTitle, newIdx, dueDate, listId, descStr)
+    def boardLists(self, boardId):
+        '''
+        Lists of a board with their card counts
+        '''
         sql = '''
-            INSERT INTO cards(title, idx, dueDate, list, content)
-            VALUES (?, ?, ?, ?, ?)
+            SELECT lists.ROWID, lists.title, COUNT(cards.ROWID)
+            FROM lists
+            LEFT JOIN cards ON cards.list = lists.ROWID
+            WHERE lists.board = ?
+            GROUP BY lists.idx, lists.ROWID
+            ORDER BY lists.idx ASC
         '''
-        self.db.execute(sql, values)
-        return
+        rows = self.execute(sql, (boardId,))
+        return list(map(ListRow._make, rows))
 
-    def addList(self, command):
+    def allBoards(self):
+        sql = '''
+            SELECT ROWID, title
+            FROM boards
+            ORDER BY idx ASC
         '''
-        add-list "List title" to 123
+        rows = self.execute(sql)
+        return list(map(BoardRow._make, rows))
+
+    def boardTree(self):
+        '''
+        Every board with its lists and their card counts. Boards without
+        lists get a single row with listId None.
         '''
-        # Parse command string
-        pat = r'add-list "(.*)" to (\d*)'
-        match = re.match(pat, command)
-        newListTitle = match.group(1)
-        boardId = match.group(2)
+        # Counting in one pass over cards(list, idx) beats grouping the join
+        sql = '''
+            SELECT
+                boards.ROWID, boards.title,
+                lists.ROWID, lists.title, COALESCE(counts.cardCount, 0)
+            FROM boards
+            LEFT JOIN lists ON lists.board = boards.ROWID
+            LEFT JOIN (
+                SELECT list, COUNT(*) AS cardCount
+                FROM cards
+                GROUP BY list
+            ) AS counts ON counts.list = lists.ROWID
+            ORDER BY boards.idx ASC, boards.ROWID ASC, lists.idx ASC
+        '''
+        rows = self.execute(sql)
+        return list(map(TreeRow._make, rows))
+
+    def searchCards(self, text, limit=SEARCH_PAGE_SIZE, offset=0):
+        '''
+        Cards matching every word of text, best match first when there
+        are at most SEARCH_RANK_WINDOW of them. Past that, the order is by
+        recency window, not relevance: matches are ranked
+        SEARCH_RANK_WINDOW at a time, newest first, and come best match
+        first within each window (see searchIsWindowed). offset picks the
+        window, so every page of a window ranks the same matches and
+        paging on never repeats or skips a card.
+        '''
+        query = searchQuery(text)
+        if query is None:
+            return []
+        window, offset = divmod(offset, SEARCH_RANK_WINDOW)
+        sql = '''
+            SELECT
+                cards.ROWID, cards.title,
+                lists.ROWID, lists.title,
+                boards.ROWID, boards.title
+            FROM (
+                SELECT cardId, rank
+                FROM (
+                    SELECT rowid AS cardId, rank
+                    FROM cardsSearch
+                    WHERE cardsSearch MATCH ?
+                    ORDER BY rowid DESC
+                    LIMIT ? OFFSET ?
+                )
+                ORDER BY rank, cardId DESC
+                LIMIT ? OFFSET ?
+            ) AS hits
+            JOIN cards ON cards.ROWID = hits.cardId
+            JOIN lists ON lists.ROWID = cards.list
+            JOIN boards ON boards.ROWID = lists.board
+            ORDER BY hits.rank, hits.cardId DESC
+        '''
+        values = (query, SEARCH_RANK_WINDOW, window * SEARCH_RANK_WINDOW,
+                  limit, offset)
+        rows = self.execute(sql, values)
+        return list(map(SearchRow._make, rows))
+
+    def searchIsWindowed(self, text):
+        '''
+        Whether text has more than SEARCH_RANK_WINDOW matches, so
+        searchCards ranks them by recency window rather than all at once
+        '''
+        query = searchQuery(text)
+        if query is None:
+            return False
+        # Steps over the first window of rowids without ranking them
+        sql = '''
+            SELECT 1
+            FROM cardsSearch
+            WHERE cardsSearch MATCH ?
+            ORDER BY rowid DESC
+            LIMIT 1 OFFSET ?
+        '''
+        row = self.execute(sql, (query, SEARCH_RANK_WINDOW)).fetchone()
+        return row is not None
 
-        # Get new index
-        newIdx = self.getMaxIdx('lists', 'board', boardId)
+    def allButtons(self):
+        sql = '''
+            SELECT ROWID, name, command
+            FROM buttons
+            ORDER BY idx ASC
+        '''
+        rows = self.execute(sql)
+        return list(map(ButtonRow._make, rows))
 
-        # Insert list into table
-        values = (newListTitle, newIdx, boardId)
-        sql = f'INSERT INTO lists(title, idx, board) VALUES {values}'
-        self.db.execute(sql)
-        return
+    def buttonCommand(self, buttonId):
+        sql = 'SELECT command FROM buttons WHERE ROWID = ?'
+        return self.execute(sql, (buttonId,)).fetchone()[0]
 
-    def addBoard(self, command):
+    def dueCardsAfter(self, after, limit, until=2**63 - 1):
         '''
-        add-board "Board title"
+        Returns up to limit (dueDate, ROWID) rows of cards with a due
+        date, in due order, starting after the (dueDate, ROWID) key after
+        and due by until
         '''
-        # Parse command string
-        pat = r'add-board "(.*)"'
-        match = re.match(pat, command)
-        newBoardTitle = match.group(1).strip('"')
+        sql = '''
+            SELECT dueDate, ROWID
+            FROM cards
+            WHERE (dueDate, ROWID) > (?, ?) AND dueDate <= ?
+            ORDER BY dueDate, ROWID
+            LIMIT ?
+        '''
+        return self.execute(sql, (*after, until, limit)).fetchall()
 
-        # Get new index
-        newIdx = self.getMaxIdx('boards')
+    def cardDueDates(self, cardIds):
+        '''
+        Maps each of cardIds that still exists to its due date
+        '''
+        sql = '''
+            SELECT ROWID, dueDate
+            FROM cards
+            WHERE ROWID IN (SELECT value FROM json_each(?))
+        '''
+        return dict(self.execute(sql, (json.dumps(list(cardIds)),)))
 
-        # Insert board into table
-        values = (newBoardTitle, newIdx)
-        sql = f'INSERT INTO boards(title, idx) VALUES {values}'
-        self.db.execute(sql)
-        return
+    def getSetting(self, name, default=None):
+        sql = 'SELECT value FROM settings WHERE name = ?'
+        row = self.execute(sql, (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def insertCard(self, title, listId, content='', dueDate=-1):
+        with self.batch():
+            newIdx = self.getMaxIdx('cards', 'list', listId)
+            sql = '''
+                INSERT INTO cards(title, idx, dueDate, list, content)
+                VALUES (?, ?, ?, ?, ?)
+            '''
+            values = (title, newIdx, dueDate, listId, content)
+            cardId = self.execute(sql, values).lastrowid
+            self.publish(CARDS_INSERTED, [cardId], [listId])
+        if self.scheduler is not None:
+            self.scheduler.dueDateSet(cardId, dueDate)
+        return cardId
 
-    def addButton(self, command):
+    def updateCard(self, cardId, title=None, content=None, dueDate=None):
         '''
-        add-button "Button title" "command"
+        Sets whichever of title, content and dueDate are given
         '''
-        # Parse command string
-        pat = r'add-button "(.*)" "(.*)"'
-        match = re.match(pat, command)
-        newButtonName = match.group(1).strip('"')
-        newButtonCommand = match.group(2).strip('"')
+        if dueDate is not None:
+            dueDate = int(dueDate)
 
-        # Get new index
-        newIdx = self.getMaxIdx('buttons')
+        # A NULL leaves the column as it is
+        sql = '''
+            UPDATE cards
+            SET title = COALESCE(?, title),
+                content = COALESCE(?, content),
+                dueDate = COALESCE(?, dueDate)
+            WHERE ROWID = ?
+            RETURNING list
+        '''
+        with self.batch():
+            rows = self.execute(sql, (title, content, dueDate, cardId))
+            self.publish(CARDS_UPDATED, [cardId], [row[0] for row in rows])
+        if dueDate is not None and self.scheduler is not None:
+            self.scheduler.dueDateSet(cardId, dueDate)
+        return
 
-        # Insert button into table
-        values = (newButtonName, newButtonCommand, newIdx)
-        sql = f'INSERT INTO buttons(name, command, idx) VALUES {values}'
-        self.db.execute(sql)
+    def moveCardToList(self, cardId, listId):
+        self.moveCardsToList([cardId], listId)
         return
 
-    def setCardContent(self, command):
+    def moveCardsToList(self, cardIds, listId):
         '''
-        set-card-content 123 to "content"
+        Appends cardIds, in that order, to the end of listId
         '''
-        pat = r'set-card-content (\d*) "(.*)"'
-        match = re.match(pat, command)
-        cardId = match.group(1)
-        content = match.group(2).strip('"')
-        content = content.replace('\t', ' '*4)
-        content = content.replace('\n', '<|NEWLINE|>')
+        sql = '''
+            UPDATE cards
+            SET list = ?, idx = ? + picked.key * ?
+            FROM json_each(?) AS picked
+            WHERE cards.ROWID = picked.value
+        '''
+        cardIds = list(cardIds)
+        with self.batch():
+            sourceListIds = list(self.cardLists(cardIds))
+            newIdx = self.getMaxIdx('cards', 'list', listId)
+            values = (listId, newIdx, IDX_GAP, json.dumps(cardIds))
+            self.execute(sql, values)
+            self.publish(CARDS_MOVED, cardIds, sourceListIds + [listId])
+        return
 
-        sql = f'''
+    def cardLists(self, cardIds):
+        '''
+        Maps the list of each of cardIds to its cards among them, in the
+        order they were given
+        '''
+        sql = '''
+            SELECT cards.list, cards.ROWID
+            FROM json_each(?) AS picked
+            JOIN cards ON cards.ROWID = picked.value
+            ORDER BY picked.key
+        '''
+        lists = {}
+        for listId, cardId in self.execute(sql, (json.dumps(cardIds),)):
+            lists.setdefault(listId, []).append(cardId)
+        return lists
+
+    def placeCard(self, cardId, position):
+        with self.batch():
+            sql = 'SELECT list FROM cards WHERE ROWID = ?'
+            listId = self.execute(sql, (cardId,)).fetchone()[0]
+            self.placeAt('cards', cardId, position, 'list', listId)
+            self.publish(CARDS_MOVED, [cardId], [listId])
+        return
+
+    def moveOverdueCards(self, sourceListIds, destListId, now=None):
+        '''
+        Moves the cards of sourceListIds whose due date has passed into
+        destListId
+        '''
+        if now is None:
+            now = int(time.time())
+        # The ids go in as one JSON array so the text stays the same
+        sql = '''
             UPDATE cards
-            SET content = '{content}'
-            WHERE ROWID = {cardId}
+            SET list = ?
+            WHERE list IN (SELECT value FROM json_each(?))
+            AND dueDate < ?
+            AND dueDate > 0
+            RETURNING ROWID
+        '''
+        values = (destListId, json.dumps(list(sourceListIds)), now)
+        with self.batch():
+            cardIds = [row[0] for row in self.execute(sql, values)]
+            self.reindex('cards', 'list', destListId)
+            if cardIds:
+                self.publish(CARDS_MOVED, cardIds,
+                             list(sourceListIds) + [destListId])
+        return
+
+    def removeCard(self, cardId):
+        self.removeCards([cardId])
+        return
+
+    def removeCards(self, cardIds):
+        sql = '''
+            DELETE FROM cards
+            WHERE ROWID IN (SELECT value FROM json_each(?))
+            RETURNING ROWID, list
         '''
-        self.db.execute(sql)
+        with self.batch():
+            rows = self.execute(sql, (json.dumps(list(cardIds)),)).fetchall()
+            if rows:
+                self.publish(CARDS_DELETED, *zip(*rows))
+        return
+
+    def setCardsDueDate(self, cardIds, dueDate):
+        sql = '''
+            UPDATE cards
+            SET dueDate = ?
+            WHERE ROWID IN (SELECT value FROM json_each(?))
+            RETURNING ROWID, list
+        '''
+        with self.batch():
+            values = (dueDate, json.dumps(list(cardIds)))
+            rows = self.execute(sql, values).fetchall()
+            if rows:
+                self.publish(CARDS_UPDATED, *zip(*rows))
+        if self.scheduler is not None:
+            for cardId in cardIds:
+                self.scheduler.dueDateSet(cardId, dueDate)
+        return
+
+    def insertList(self, title, boardId):
+        with self.batch():
+            newIdx = self.getMaxIdx('lists', 'board', boardId)
+            sql = 'INSERT INTO lists(title, idx, board) VALUES (?, ?, ?)'
+            values = (title, newIdx, boardId)
+            listId = self.execute(sql, values).lastrowid
+            self.publish(LISTS_INSERTED, [listId], [boardId])
+        return listId
+
+    def updateList(self, listId, title):
+        sql = 'UPDATE lists SET title = ? WHERE ROWID = ? RETURNING board'
+        with self.batch():
+            rows = self.execute(sql, (title, listId))
+            self.publish(LISTS_RENAMED, [listId], [row[0] for row in rows])
+        return
+
+    def moveListToBoard(self, listId, boardId):
+        sql = 'UPDATE lists SET board = ? WHERE ROWID = ?'
+        with self.batch():
+            oldSql = 'SELECT board FROM lists WHERE ROWID = ?'
+            oldBoardIds = [row[0] for row in self.execute(oldSql, (listId,))]
+            self.execute(sql, (boardId, listId))
+            self.publish(LISTS_MOVED, [listId], oldBoardIds + [boardId])
+        return
+
+    def placeList(self, listId, position):
+        with self.batch():
+            sql = 'SELECT board FROM lists WHERE ROWID = ?'
+            boardId = self.execute(sql, (listId,)).fetchone()[0]
+            self.placeAt('lists', listId, position, 'board', boardId)
+            self.publish(LISTS_MOVED, [listId], [boardId])
+        return
+
+    def removeList(self, listId):
+        sql = 'DELETE FROM lists WHERE ROWID = ? RETURNING board'
+        with self.batch():
+            rows = self.execute(sql, (listId,)).fetchall()
+            self.publish(LISTS_DELETED, [listId], [row[0] for row in rows])
+        return
+
+    def insertBoard(self, title):
+        with self.batch():
+            newIdx = self.getMaxIdx('boards')
+            sql = 'INSERT INTO boards(title, idx) VALUES (?, ?)'
+            values = (title, newIdx)
+            boardId = self.execute(sql, values).lastrowid
+            self.invalidateBoards()
+            self.publish(BOARDS_INSERTED, [boardId])
+        return boardId
+
+    def updateBoard(self, boardId, title):
+        sql = 'UPDATE boards SET title = ? WHERE ROWID = ?'
+        with self.batch():
+            self.execute(sql, (title, boardId))
+            self.publish(BOARDS_RENAMED, [boardId])
+        return
+
+    def placeBoard(self, boardId, position):
+        with self.batch():
+            self.placeAt('boards', boardId, position)
+            self.invalidateBoards()
+            self.publish(BOARDS_MOVED, [boardId])
+        return
+
+    def removeBoard(self, boardId):
+        with self.batch():
+            # Go with the board through ON DELETE CASCADE, models showing
+            # one of them need to hear about it
+            listIds = self.listsInBoard(boardId)
+            self.execute('DELETE FROM boards WHERE ROWID = ?', (boardId,))
+            self.invalidateBoards()
+            if listIds:
+                self.publish(LISTS_DELETED, listIds, [boardId])
+            self.publish(BOARDS_DELETED, [boardId])
+            if boardId == self.boardId:
+                self.boardId = None
         return
 
-    def getCardContent(self, command):
+    def insertButton(self, name, command):
+        with self.batch():
+            newIdx = self.getMaxIdx('buttons')
+            sql = 'INSERT INTO buttons(name, command, idx) VALUES (?, ?, ?)'
+            values = (name, command, newIdx)
+            buttonId = self.execute(sql, values).lastrowid
+            self.publish(BUTTONS_CHANGED, [buttonId])
+        return buttonId
+
+    def updateButton(self, buttonId, name, command):
+        sql = 'UPDATE buttons SET name = ?, command = ? WHERE ROWID = ?'
+        values = (name, command, buttonId)
+        with self.batch():
+            self.execute(sql, values)
+            self.publish(BUTTONS_CHANGED, [buttonId])
+        return
+
+    def removeButton(self, buttonId):
+        sql = 'DELETE FROM buttons WHERE ROWID = ?'
+        with self.batch():
+            self.execute(sql, (buttonId,))
+            self.publish(BUTTONS_CHANGED, [buttonId])
+        return
+
+    def setSetting(self, name, value):
+        sql = 'INSERT OR REPLACE INTO settings(name, value) VALUES (?, ?)'
+        with self.batch():
+            self.execute(sql, (name, value))
+        return
+
+    def runDueRule(self, cardIds):
         '''
-        get-card-content 123
+        Runs the due rule for cards that came due. A rule with $CARD in
+        it runs once per card, any other rule (e.g. move-due-cards) once.
         '''
-        pat = r'get-card-content (\d*)'
-        match = re.match(pat, command)
-        cardId = match.group(1)
+        rule = self.getSetting('dueRule', '')
+        if not rule:
+            return
+        if '$CARD' in rule:
+            cmds = [rule.replace('$CARD', str(cardId)) for cardId in cardIds]
+        else:
+            cmds = [rule]
+        self.runCommands(cmds)
+        return
 
-        sql = f'''
-            SELECT content
+    def runDueCards(self, now=None):
+        '''
+        Runs the due rule on the cards whose due date passed since the
+        last call. Returns how many there were and the next due date.
+        '''
+        if self.scheduler is None:
+            self.scheduler = scheduler.DueScheduler(self, now)
+        return self.scheduler.tick(now)
+
+    def exportRecords(self):
+        '''
+        Yields every board, list, card and button as a dict, parents
+        before their children and each group in display order
+        '''
+        sql = 'SELECT ROWID, title FROM boards ORDER BY idx ASC'
+        for rowId, title in self.execute(sql):
+            yield {'type': 'board', 'id': rowId, 'title': title}
+
+        sql = '''
+            SELECT ROWID, board, title
+            FROM lists
+            ORDER BY board ASC, idx ASC
+        '''
+        for rowId, boardId, title in self.execute(sql):
+            yield {'type': 'list', 'id': rowId, 'parent': boardId,
+                   'title': title}
+
+        sql = '''
+            SELECT ROWID, list, title, COALESCE(content, ''), dueDate
             FROM cards
-            WHERE ROWID = {cardId}
+            ORDER BY list ASC, idx ASC
         '''
-        self.db.execute(sql)
+        for rowId, listId, title, content, dueDate in self.execute(sql):
+            yield {'type': 'card', 'id': rowId, 'parent': listId,
+                   'title': title, 'content': content, 'dueDate': dueDate}
+
+        sql = 'SELECT ROWID, name, command FROM buttons ORDER BY idx ASC'
+        for rowId, name, command in self.execute(sql):
+            yield {'type': 'button', 'id': rowId, 'title': name,
+                   'content': command}
         return
 
-    def setDueIn(self, command):
+    def importRecords(self, records):
         '''
-        set-due-in 123 12d/w/m/y
+        Adds records shaped like exportRecords' after the existing data,
+        all in one transaction. ids only link records within the import,
+        everything gets a new ROWID. Returns how many rows were added;
+        records whose parent was not imported are skipped.
         '''
-        pat = r'set-due-in (\d+) (\d+d|\d+w|\d+m|\d+y)'
-        match = re.match(pat, command)
-        cardId = match.group(1)
-        interval = match.group(2)
+        boardIds = {}
+        listIds = {}
+        nextIdx = {}
+        cards = []
+        count = 0
 
-        num = int(interval[:-1])
-        unit = interval[-1]
+        def appendIdx(table, field='', fieldVal=''):
+            key = (table, fieldVal)
+            if key not in nextIdx:
+                nextIdx[key] = self.getMaxIdx(table, field, fieldVal)
+            idx = nextIdx[key]
+            nextIdx[key] += IDX_GAP
+            return idx
 
-        coefMap = {
-            'd': 24*60*60,
-            'w': 24*60*60*7,
-            'm': 24*60*60*30,
-            'y': 24*60*60*365,
-        }
-        coef = coefMap[unit]
-        dueDate = (num*coef) + int(time.time())
+        cardSql = '''
+            INSERT INTO cards(title, idx, dueDate, list, content)
+            VALUES (?, ?, ?, ?, ?)
+        '''
+        listSql = 'INSERT INTO lists(title, idx, board) VALUES (?, ?, ?)'
+        boardSql = 'INSERT INTO boards(title, idx) VALUES (?, ?)'
+        buttonSql = 'INSERT INTO buttons(name, command, idx) VALUES (?, ?, ?)'
+        with self.batch():
+            for record in records:
+                kind = record['type']
+                if kind == 'card':
+                    listId = listIds.get(record.get('parent'))
+                    if listId is None:
+                        continue
+                    dueDate = record.get('dueDate')
+                    cards.append((
+                        record.get('title') or '',
+                        appendIdx('cards', 'list', listId),
+                        -1 if dueDate is None else dueDate,
+                        listId,
+                        record.get('content') or ''))
+                    if len(cards) >= IMPORT_CHUNK_SIZE:
+                        self.db.executemany(cardSql, cards)
+                        count += len(cards)
+                        cards = []
+                elif kind == 'list':
+                    boardId = boardIds.get(record.get('parent'))
+                    if boardId is None:
+                        continue
+                    values = (record.get('title') or '',
+                              appendIdx('lists', 'board', boardId), boardId)
+                    listIds[record.get('id')] = self.execute(
+                        listSql, values).lastrowid
+                    count += 1
+                elif kind == 'board':
+                    values = (record.get('title') or '', appendIdx('boards'))
+                    boardIds[record.get('id')] = self.execute(
+                        boardSql, values).lastrowid
+                    count += 1
+                elif kind == 'button':
+                    values = (record.get('title') or '',
+                              record.get('content') or '',
+                              appendIdx('buttons'))
+                    self.execute(buttonSql, values)
+                    count += 1
+            if cards:
+                self.db.executemany(cardSql, cards)
+                count += len(cards)
+            self.invalidateBoards()
+            if count:
+                self.publish(RESET, [])
+        if self.scheduler is not None:
+            self.scheduler.reset()
+        return count
+
+    # Command handlers
+
+    def addCard(self, match):
+        '''
+        add-card "card title":"description":123 to 123
+        add-card "card title":"description":123 to "list title"
+        '''
+        cardTitle = unescapeText(match.group(1))
+        descStr = unescapeText(match.group(2))
+        dueDate = int(match.group(3) or -1)
+        listId = self.getListId(match.group(4))
+        self.insertCard(cardTitle, listId, descStr, dueDate)
+        return
 
-        sql = f'''
-            UPDATE cards
-            SET dueDate = {dueDate}
-            WHERE ROWID = {cardId}
+    def addList(self, match):
+        '''
+        add-list "List title" to 123
         '''
-        self.db.execute(sql)
+        newListTitle = unescapeText(match.group(1))
+        boardId = int(match.group(2))
+        self.insertList(newListTitle, boardId)
         return
 
-    def setDueDate(self, command):
+    def addBoard(self, match):
+        '''
+        add-board "Board title"
+        '''
+        newBoardTitle = unescapeText(match.group(1).strip('"'))
+        self.insertBoard(newBoardTitle)
+        return
+
+    def addButton(self, match):
+        '''
+        add-button "Button title" "command"
+        '''
+        newButtonName = unescapeText(match.group(1).strip('"'))
+        newButtonCommand = unescapeText(match.group(2).strip('"'))
+        self.insertButton(newButtonName, newButtonCommand)
+        return
+
+    def setCardContent(self, match):
+        '''
+        set-card-content 123 to "content"
+        '''
+        cardId = int(match.group(1))
+        content = unescapeText(match.group(2).strip('"'))
+        self.updateCard(cardId, content=content)
+        return
+
+    def getCardContent(self, match):
+        '''
+        get-card-content 123
+        '''
+        cardId = int(match.group(1))
+        return escapeText(self.card(cardId).content)
+
+    def setDueIn(self, match):
+        '''
+        set-due-in 123 12d/w/m/y
+        '''
+        cardId = int(match.group(1))
+        self.updateCard(cardId, dueDate=dueDateIn(match.group(2)))
+        return
+
+    def setDuesIn(self, match, cardIds):
+        '''
+        set-due-in $CARD 12d/w/m/y, over cardIds
+        '''
+        self.setCardsDueDate(cardIds, dueDateIn(match.group(2)))
+        return
+
+    def setDueDate(self, match):
         '''
         set-due-date 123 1234561234
         '''
-        pat = r'set-due-date (\d+) (\d+|-1)'
-        match = re.match(pat, command)
-        cardId = match.group(1)
-        dueDate = match.group(2)
+        cardId = int(match.group(1))
+        dueDate = int(match.group(2))
+        self.updateCard(cardId, dueDate=dueDate)
+        return
 
-        sql = f'''
-            UPDATE cards
-            SET dueDate = {dueDate}
-            WHERE ROWID = {cardId}
+    def setDueDates(self, match, cardIds):
         '''
-        self.db.execute(sql)
+        set-due-date $CARD 1234561234, over cardIds
+        '''
+        self.setCardsDueDate(cardIds, int(match.group(2)))
         return
 
-    def getDueDate(self, command):
+    def getDueDate(self, match):
         '''
         get-due-date 123
         '''
-        pat = r'get-due-date (\d*)'
-        match = re.match(pat, command)
-        cardId = match.group(1)
+        cardId = int(match.group(1))
+        return self.card(cardId).dueDate
 
-        sql = f'''
-            SELECT dueDate
-            FROM cards
-            WHERE ROWID = {cardId}
+    def moveDueCards(self, match):
         '''
-        self.db.execute(sql)
+        move-due-cards 123,123,123 to 123
+        '''
+        sourceListIds = [int(i) for i in match.group(1).split(',') if i]
+        destListId = int(match.group(2))
+        self.moveOverdueCards(sourceListIds, destListId)
         return
 
-    def moveDueCards(self, command):
+    def setDueRuleCommand(self, match):
         '''
-        move-due-cards 123,123,123 to 123
+        set-due-rule "move-card $CARD to 3"
         '''
-        pat = r'move-due-cards ([\d,]+) to (\d+)'
-        match = re.match(pat, command)
-        sourceListIds = match.group(1)
-        destListId = match.group(2)
-        today = int(time.time())
+        rule = unescapeText(match.group(1))
+        if rule:
+            # Raises on a rule that is not a command
+            parseCommand(rule.replace('$CARD', '0'))
+        self.setSetting('dueRule', rule)
+        return
 
-        sql = f'''
-            UPDATE cards
-            SET list = {destListId}
-            WHERE list IN ({sourceListIds})
-            AND dueDate < {today}
-            AND dueDate > 0
+    def getDueRuleCommand(self, match):
+        '''
+        get-due-rule
         '''
-        self.db.execute(sql)
-        self.reindex('cards', 'list', destListId)
-        return 
+        return escapeText(self.getSetting('dueRule', ''))
 
-    def renameButton(self, command):
+    def runDueCardsCommand(self, match):
         '''
-        rename-button 123 "Button title" "command"
+        run-due-cards
         '''
-        # Parse command string
-        pat = r'rename-button (\d*) "(.*)" "(.*)"'
-        match = re.match(pat, command)
+        fired, nextDue = self.runDueCards()
+        return f'{fired} cards due, next due date: {nextDue}'
 
-        buttonId = match.group(1)
-        buttonTitle = match.group(2)
-        buttonCommand = match.group(3)
+    def showSettings(self, match):
+        '''
+        show-settings
+        '''
+        rows = self.connectionSettings().items()
+        return formatTable(('setting', 'value'), rows)
 
-        sql = f'''
-            UPDATE buttons
-            SET name = '{buttonTitle}',
-                command = '{buttonCommand}'
-            WHERE ROWID = {buttonId}
-            '''
-        self.db.execute(sql)
+    def showStatementCache(self, match):
+        '''
+        show-statement-cache
+        '''
+        rows = self.statementCacheStats().items()
+        return formatTable(('setting', 'value'), rows)
 
-    def renameBoard(self, command):
+    def statsCommand(self, match):
         '''
-        rename-board 123 "board title"
+        stats
+        stats reset
+        stats json
         '''
-        # Parse command string
-        pat = r'rename-board (\d*) "(.*)"'
-        match = re.match(pat, command)
+        if self.profiler is None:
+            raise ValueError('Command stats are off, see Database(stats=True)')
+        if match.group(1) == 'reset':
+            self.profiler.reset()
+            return
+        verbs = self.profiler.asDict()
+        if match.group(1) == 'json':
+            return json.dumps({'time': int(time.time()), 'verbs': verbs})
+        header = ('verb', 'count', 'totalMs', 'p50Ms', 'p95Ms', 'p99Ms',
+                  'rows', 'commitMs')
+        rows = [(verb, *stats.values()) for verb, stats in verbs.items()]
+        return formatTable(header, rows)
 
-        boardId = match.group(1)
-        boardTitle = match.group(2)
+    def searchCardsCommand(self, match):
+        '''
+        search-cards "words"
+        search-cards "words" page 2
+        '''
+        text = unescapeText(match.group(1))
+        page = int(match.group(2) or 1)
+        offset = (page - 1) * SEARCH_PAGE_SIZE
+        rows = self.searchCards(text, SEARCH_PAGE_SIZE, offset)
+        header = ('id', 'title', 'list', 'listTitle', 'board', 'boardTitle')
+        return formatTable(header, rows)
 
-        sql = f'''
-            UPDATE boards
-            SET title = '{boardTitle}'
-            WHERE ROWID = {boardId}
-            '''
-        self.db.execute(sql)
+    def exportTo(self, match):
+        '''
+        export "path.jsonl"
+        export "path.csv"
+        '''
+        path = unescapeText(match.group(1))
+        start = time.perf_counter()
+        count = transfer.writeRecords(self.exportRecords(), path)
+        elapsed = time.perf_counter() - start
+        rate = count / elapsed if elapsed else 0
+        return (f'Exported {count} rows to {path} in {elapsed:.2f}s'
+                f' ({rate:.0f} rows/s)')
 
-    def renameList(self, command):
+    def importFrom(self, match):
         '''
-        rename-list 123 "list title"
+        import "path.jsonl"
+        import "path.csv"
         '''
-        # Parse command string
-        pat = r'rename-list (\d*) "(.*)"'
-        match = re.match(pat, command)
+        path = unescapeText(match.group(1))
+        start = time.perf_counter()
+        count = self.importRecords(transfer.readRecords(path))
+        elapsed = time.perf_counter() - start
+        rate = count / elapsed if elapsed else 0
+        return (f'Imported {count} rows from {path} in {elapsed:.2f}s'
+                f' ({rate:.0f} rows/s)')
 
-        listId = match.group(1)
-        listTitle = match.group(2)
+    def reindexAll(self, match):
+        '''
+        reindex
+        '''
+        self.reindex('cards', 'list')
+        self.reindex('lists', 'board')
+        self.reindex('boards')
+        self.reindex('buttons')
+        return
 
-        sql = f'''
-            UPDATE lists
-            SET title = '{listTitle}'
-            WHERE ROWID = {listId}
-            '''
-        self.db.execute(sql)
+    def repairOrphansCommand(self, match):
+        '''
+        repair-orphans
+        '''
+        rows = self.repairOrphans().items()
+        return formatTable(('table', 'deleted'), rows)
 
-    def renameCard(self, command):
+    def renameButton(self, match):
         '''
-        rename-card 123 "Card title"
+        rename-button 123 "Button title" "command"
         '''
-        # Parse command string
-        pat = r'rename-card (\d*) "(.*)"'
-        match = re.match(pat, command)
+        buttonId = int(match.group(1))
+        buttonTitle = unescapeText(match.group(2))
+        buttonCommand = unescapeText(match.group(3))
+        self.updateButton(buttonId, buttonTitle, buttonCommand)
+        return
 
-        cardId = match.group(1)
-        cardTitle = match.group(2)
+    def renameBoard(self, match):
+        '''
+        rename-board 123 "board title"
+        '''
+        boardId = int(match.group(1))
+        boardTitle = unescapeText(match.group(2))
+        self.updateBoard(boardId, boardTitle)
+        return
 
-        sql = f'''
-            UPDATE cards
-            SET title = '{cardTitle}'
-            WHERE ROWID = {cardId}
-            '''
-        self.db.execute(sql)
+    def renameList(self, match):
+        '''
+        rename-list 123 "list title"
+        '''
+        listId = int(match.group(1))
+        listTitle = unescapeText(match.group(2))
+        self.updateList(listId, listTitle)
+        return
+
+    def renameCard(self, match):
+        '''
+        rename-card 123 "Card title"
+        '''
+        cardId = int(match.group(1))
+        cardTitle = unescapeText(match.group(2))
+        self.updateCard(cardId, title=cardTitle)
+        return
 
-    def showCards(self, command):
+    def showCards(self, match):
         '''
         show-cards "List title"
         show-cards 123
         '''
-        pat = r'show-cards (".*"|\d*)'
-        match = re.match(pat, command)
+        listId = self.getListId(match.group(1))
+        rows = (
+            (card.id, card.dueDate, card.title, card.content)
+            for card in self.cardsInList(listId))
+        return formatTable(('id', 'due', 'title', 'content'), rows)
 
-        # Get list id
-        listStr = match.group(1)
-        listId = self.getListId(listStr)
-
-        # Get cards in the list
-        sql = f'''
-            SELECT ROWID, title, dueDate, content
-            FROM cards
-            WHERE list={listId}
-            ORDER BY idx ASC'''
-        cards = self.db.execute(sql)
-
-        # Show results
-        result = 'id\tdue\ttitle\tcontent\n'
-        for card in cards:
-            result += f'{card[0]}\t{card[2]}\t{card[1]}\t{card[3] or ""}\n'
-        return result
-
-    def showLists(self, command):
+    def showLists(self, match):
         '''
         show-lists
         show-lists "board name"
         show-lists 123
         '''
-        pat = r'show-lists (".*"|\d*)'
-        match = re.match(pat, command)
-
-        # Get the board id
-        if match is None:
-            sql = 'SELECT ROWID FROM boards ORDER BY idx ASC'
-            boardId = list(self.db.execute(sql))[self.boardIdx][0]
+        if not match.group(1):
+            boardId = self.getCurrentBoardId()
         else:
-            boardStr = match.group(1)
-            boardId = self.getBoardId(boardStr)
+            boardId = self.getBoardId(match.group(1))
 
-        # Get the lists in that board
-        sql = f'''
-            SELECT ROWID, title, idx
-            FROM lists
-            WHERE board={boardId}
-            ORDER BY idx ASC
-            '''
-        lists = self.db.execute(sql)
-
-        # Show the results
-        result = 'id\ttitle\tcards\n'
-        for _list in lists:
-            sql = f"SELECT ROWID FROM cards WHERE list='{_list[0]}'"
-            cardCount = len(list(self.db.execute(sql)))
-            result += f'{_list[0]}\t{_list[1]}\t{cardCount}\n'
-        return result
+        rows = self.boardLists(boardId)
+        return formatTable(('id', 'title', 'cards'), rows)
 
-    def showBoards(self, command):
+    def showTree(self, match):
         '''
-        show-boards
-        '''
-        sql = '''
-            SELECT ROWID, title
-            FROM boards
-            ORDER BY idx ASC
+        show-tree
         '''
-        boards = list(self.db.execute(sql))
+        rows = []
+        for row in self.boardTree():
+            if row.listId is None:
+                listId, listTitle = '', ''
+            else:
+                listId, listTitle = row.listId, row.listTitle
+            rows.append((
+                row.boardId, row.boardTitle,
+                listId, listTitle, row.cardCount))
+        header = ('board', 'boardTitle', 'list', 'listTitle', 'cards')
+        return formatTable(header, rows)
 
-        result = 'id\ttitle\n'
-        for board in boards:
-            result += f'{board[0]}\t{board[1]}\n'
-        return result
+    def showBoards(self, match):
+        '''
+        show-boards
+        '''
+        return formatTable(('id', 'title'), self.allBoards())
 
-    def showButtons(self, command):
+    def showButtons(self, match):
         '''
         show-buttons
         '''
-        sql = '''
-            SELECT ROWID, name, command
-            FROM buttons
-            ORDER BY idx ASC
-        '''
-        buttons = list(self.db.execute(sql))
-
-        result = 'id\tname\tcommand\n'
-        for button in buttons:
-            result += f'{button[0]}\t{button[1]}\t{button[2]}\n'
-        return result
+        return formatTable(('id', 'name', 'command'), self.allButtons())
 
-    def getButton(self, command):
+    def getButton(self, match):
         '''
         get-button
         '''
-        argPat = r'get-button (\d*)'
-        match = re.match(argPat, command)
-
-        buttonId = match.group(1)
-        sql = f'''
-            SELECT command
-            FROM buttons
-            WHERE ROWID = {buttonId}
-        '''
-        command = self.db.execute(sql).fetchone()[0]
-        return command
+        buttonId = int(match.group(1))
+        return self.buttonCommand(buttonId)
 
     def listsInBoard(self, boardId):
-        sql = f'''SELECT ROWID FROM lists
-                WHERE board = {boardId} ORDER BY idx ASC'''
-        listsInBoard = [r[0] for r in self.db.execute(sql)]
+        sql = '''SELECT ROWID FROM lists
+                WHERE board = ? ORDER BY idx ASC'''
+        listsInBoard = [r[0] for r in self.execute(sql, (boardId,))]
         return listsInBoard
 
-    def moveCard(self, command):
+    def moveCard(self, match):
         '''
         move-card 123 to "list title"
         move-card 123 to "list title" in "board title"
@@ -659,233 +1881,121 @@ class Database:
         move-card 123 to next
         move-card 123 to prev
         '''
-        argPat = r'move-card (?P<cardStr>".+"|\d+)'
-        argPat += r' to (?P<listDstStr>".+"|\d+|next|prev)'
-        argPat += r'(?: in (?P<boardStr>".+"|\d+))?'
-        match = re.match(argPat, command)
-
-        cardId = match.group('cardStr')
+        cardId = int(match.group('cardStr'))
+        boardId = self.moveBoardId(match)
+        step = moveStep(match)
 
-        if match.group('boardStr'):
-            boardId = self.getBoardId(match.group('boardStr'))
+        if step:
+            sql = 'SELECT list FROM cards WHERE ROWID = ?'
+            currentListId = self.execute(sql, (cardId,)).fetchone()[0]
+            listDstId = self.neighbourList(boardId, currentListId, step)
         else:
-            boardId = self.getCurrentBoardId()
-
-        if 'next' in match.group('listDstStr'):
-            sql = f'SELECT list FROM cards WHERE ROWID = {cardId}'
-            currentListId = self.db.execute(sql).fetchone()[0]
-            listsInBoard = self.listsInBoard(boardId)
-
-            listIdx = listsInBoard.index(currentListId)
-            nextListIdx = min(listIdx + 1, len(listsInBoard) - 1)
-            listDstId = listsInBoard[nextListIdx]
+            listDstId = self.getListId(match.group('listDstStr'), boardId)
 
-        elif 'prev' in match.group('listDstStr'):
-            sql = f'SELECT list FROM cards WHERE ROWID = {cardId}'
-            currentListId = self.db.execute(sql).fetchone()[0]
-            listsInBoard = self.listsInBoard(boardId)
+        self.moveCardToList(cardId, listDstId)
+        return
 
-            listIdx = listsInBoard.index(currentListId)
-            prevListIdx = max(listIdx - 1, 0)
-            listDstId = listsInBoard[prevListIdx]
+    def moveCards(self, match, cardIds):
+        '''
+        move-card $CARD to ..., over cardIds
+        '''
+        boardId = self.moveBoardId(match)
+        step = moveStep(match)
 
+        if step:
+            for listId, cards in self.cardLists(cardIds).items():
+                listDstId = self.neighbourList(boardId, listId, step)
+                self.moveCardsToList(cards, listDstId)
         else:
             listDstId = self.getListId(match.group('listDstStr'), boardId)
+            self.moveCardsToList(cardIds, listDstId)
+        return
 
-        self.reindex('cards', 'list', listDstId)
-        newIdx = self.getMaxIdx('cards', 'list', listDstId)
-        sql = f'''
-            UPDATE cards
-            SET list = {listDstId},
-                idx = {newIdx}
-            WHERE ROWID = {cardId}
+    def moveBoardId(self, match):
+        if match.group('boardStr'):
+            return self.getBoardId(match.group('boardStr'))
+        return self.getCurrentBoardId()
+
+    def neighbourList(self, boardId, listId, step):
         '''
-        self.db.execute(sql)
-        return
+        The list step places after listId in boardId, stopping at the ends
+        '''
+        listsInBoard = self.listsInBoard(boardId)
+        listIdx = listsInBoard.index(listId) + step
+        listIdx = min(max(listIdx, 0), len(listsInBoard) - 1)
+        return listsInBoard[listIdx]
 
-    def moveList(self, command):
+    def moveList(self, match):
         '''
         move-list "list title" to "board title"
         move-list 123 to 123
         '''
-        argPat = r'move-list (?P<listStr>".+"|\d+) to (?P<boardStr>".+"|\d+)'
-        match = re.match(argPat, command)
-
         listId = self.getListId(match.group('listStr'))
         boardId = self.getBoardId(match.group('boardStr'))
-        sql = f'''
-            UPDATE lists
-            SET board = {boardId}
-            WHERE ROWID = {listId}
-        '''
-        self.db.execute(sql)
+        self.moveListToBoard(listId, boardId)
         return
 
-    def shiftCard(self, command):
+    def shiftCard(self, match):
         '''
         shift-card <cardid> to <index>
         shift-card 123 to 0
         '''
-        argPat = r'shift-card (\d+) to (\d+|-\d+)'
-        match = re.match(argPat, command)
-        cardId = match.group(1)
+        cardId = int(match.group(1))
         newIndex = int(match.group(2))
-
-        sql = f'SELECT list FROM cards WHERE ROWID = {cardId}'
-        listId = self.db.execute(sql).fetchone()[0]
-
-        # Reindex card in case of corrupted indexes
-        self.reindex('cards', 'list', listId)
-
-        sql = f'SELECT idx FROM cards WHERE ROWID = {cardId}'
-        result = self.db.execute(sql).fetchone()
-        oldIndex = int(result[0])
-
-        sign = '-' if newIndex > oldIndex else '+'
-        sql = f'''
-            UPDATE cards SET idx = idx {sign} 1
-            WHERE {min(oldIndex, newIndex)} <= idx
-            AND idx <= {max(oldIndex, newIndex)}
-            AND list = {listId}
-        '''
-        self.db.execute(sql)
-
-        sql = f'''
-            UPDATE cards
-            SET idx = {newIndex}
-            WHERE ROWID = {cardId}
-        '''
-        self.db.execute(sql)
+        self.placeCard(cardId, newIndex)
         return
 
-    def shiftList(self, command):
+    def shiftList(self, match):
         '''
         shift-list <listid> to <index>
         shift-list 123 to 0
         '''
-        argPat = r'shift-list (\d+) to (\d+|-\d+)'
-        match = re.match(argPat, command)
-        listId = match.group(1)
+        listId = int(match.group(1))
         newIndex = int(match.group(2))
-
-        sql = f'SELECT board FROM lists WHERE ROWID = {listId}'
-        boardId = self.db.execute(sql).fetchone()[0]
-
-        # Reindex lists in case of corrupted indexes
-        self.reindex('lists', 'board', boardId)
-
-        sql = f'''
-            SELECT idx FROM lists WHERE ROWID = {listId}
-        '''
-        result = self.db.execute(sql).fetchone()
-        oldIndex = int(result[0])
-
-        sign = '-' if newIndex > oldIndex else '+'
-        sql = f'''
-            UPDATE lists SET idx = idx {sign} 1
-            WHERE {min(oldIndex, newIndex)} <= idx
-            AND idx <= {max(oldIndex, newIndex)}
-            AND board = {boardId}
-        '''
-        self.db.execute(sql)
-
-        sql = f'''
-            UPDATE lists
-            SET idx = {newIndex}
-            WHERE ROWID = {listId}
-        '''
-        self.db.execute(sql)
+        self.placeList(listId, newIndex)
         return
 
-    def shiftBoard(self, command):
+    def shiftBoard(self, match):
         '''
         shift-board <boardid> to <index>
         shift-board 123 to 0
         '''
-        argPat = r'shift-board (\d+) to (\d+|-\d+)'
-        match = re.match(argPat, command)
-        boardId = match.group(1)
+        boardId = int(match.group(1))
         newIndex = int(match.group(2))
+        self.placeBoard(boardId, newIndex)
+        return
 
-        # Reindex lists in case of corrupted indexes
-        self.reindex('boards')
-
-        sql = f'''
-            SELECT idx FROM boards WHERE ROWID = {boardId}
-        '''
-        result = self.db.execute(sql).fetchone()
-        oldIndex = int(result[0])
-
-        sign = '-' if newIndex > oldIndex else '+'
-        sql = f'''
-            UPDATE boards SET idx = idx {sign} 1
-            WHERE {min(oldIndex, newIndex)} <= idx
-            AND idx <= {max(oldIndex, newIndex)}
+    def delCard(self, match):
         '''
-        self.db.execute(sql)
-
-        sql = f'''
-            UPDATE boards
-            SET idx = {newIndex}
-            WHERE ROWID = {boardId}
+        delete-card 123
         '''
-        self.db.execute(sql)
+        self.removeCard(int(match.group('cardId')))
         return
 
-    def delCard(self, command):
-        '''
-        delete-card 123
+    def delCards(self, match, cardIds):
         '''
-        argPat = r'delete-card (?P<cardId>\d+)'
-        match = re.match(argPat, command)
-        cardId = match.group('cardId')
-        sql = f'''
-            DELETE FROM cards
-            WHERE ROWID = {cardId}
+        delete-card $CARD, over cardIds
         '''
-        self.db.execute(sql)
+        self.removeCards(cardIds)
         return
 
-    def delList(self, command):
+    def delList(self, match):
         '''
         delete-list 123
         '''
-        argPat = r'delete-list (?P<listId>\d+)'
-        match = re.match(argPat, command)
-        listId = match.group('listId')
-        sql = f'''
-            DELETE FROM lists
-            WHERE ROWID = {listId}
-        '''
-        self.db.execute(sql)
-        self.cullOrphans()
+        self.removeList(int(match.group('listId')))
         return
 
-    def delBoard(self, command):
+    def delBoard(self, match):
         '''
         delete-board 123
         '''
-        argPat = r'delete-board (?P<boardId>\d+)'
-        match = re.match(argPat, command)
-        boardId = match.group('boardId')
-        sql = f'''
-            DELETE FROM boards
-            WHERE ROWID = {boardId}
-        '''
-        self.db.execute(sql)
-        self.cullOrphans()
+        self.removeBoard(int(match.group('boardId')))
         return
 
-    def delButton(self, command):
+    def delButton(self, match):
         '''
         delete-button 123
         '''
-        pat = r'delete-button (\d*)'
-        match = re.match(pat, command)
-        boardId = match.group(1)
-        sql = f'''
-            DELETE FROM buttons
-            WHERE ROWID = {boardId}
-        '''
-        self.db.execute(sql)
+        self.removeButton(int(match.group(1)))
         return
@@ -22,6 +22,7 @@ from PySide2.QtWidgets import (
 )
 from PySide2.QtCore import (
     QFile,
+    QTimer,
     Signal,
     Slot,
 )
@@ -33,15 +34,18 @@ from PySide2.QtGui import (
 )
 
 from database import Database
+from worker import DatabaseWorker
 from sidebar import SidebarView, SidebarModel, Board, List
 from buttonTray import ButtonTray
-from center import CardView, CardModel, CardEditWidget
+from center import CardView, CardModel, LazyCardModel, CardEditWidget
+from search import SearchBox, SearchModel, SearchNote, SearchView
+from scheduler import waitFor
+from refresh import RefreshScheduler
 
 
 class NewCardTextBox(QLineEdit):
     newCardRequested = Signal(str, int)
     getCurrentList = Signal(list)
-    cardAdded = Signal(int)
 
     def __init__(self):
         QLineEdit.__init__(self)
@@ -60,7 +64,6 @@ class NewCardTextBox(QLineEdit):
         listId = listIdContainer[0]
 
         self.newCardRequested.emit(text, listId)
-        self.cardAdded.emit(listId)
         self.setText('')
         return
 
@@ -79,15 +82,26 @@ class NewBoardButton(QPushButton):
 
 
 class MainWidget(QWidget):
-    def __init__(self, db, parent=None):
+    def __init__(self, db, worker, lazyCards=False, parent=None):
         QWidget.__init__(self)
         self.db = db
+        self.worker = worker
+        self.lazyCards = lazyCards
+        # Reloads of the models below, run at most once per loop turn
+        self.refresher = RefreshScheduler(self)
         self.cardView = CardView(db)
         self.newCardTextBox = NewCardTextBox()
 
         mainLayout = QHBoxLayout()
 
         self.leftLayout = QVBoxLayout()
+        self.searchBox = SearchBox()
+        self.leftLayout.addWidget(self.searchBox)
+        self.searchNote = SearchNote()
+        self.leftLayout.addWidget(self.searchNote)
+        self.searchView = SearchView()
+        self.searchView.hide()
+        self.leftLayout.addWidget(self.searchView)
         self.sidebarView = SidebarView()
         self.leftLayout.addWidget(self.sidebarView)
         self.newBoardButton = NewBoardButton()
@@ -99,7 +113,7 @@ class MainWidget(QWidget):
         centralLayout.addWidget(self.cardView)
         mainLayout.addLayout(centralLayout)
 
-        self.buttonTray = ButtonTray(db)
+        self.buttonTray = ButtonTray(db, worker, self.refresher)
         mainLayout.addWidget(self.buttonTray)
 
         self.setLayout(mainLayout)
@@ -109,18 +123,20 @@ class MainWidget(QWidget):
         self.setupNewBoardButton()
         self.setupNewCardTextBox()
         self.setupButtonTray()
+        self.setupSearch()
+        self.setupScheduler()
         return
 
     def setupNewCardTextBox(self):
         self.newCardTextBox.getCurrentList.connect(self.cardModel.currentList)
         self.newCardTextBox.newCardRequested.connect(self.makeNewCard)
-        self.newCardTextBox.cardAdded.connect(self.cardModel.showListCards)
         return
 
     def setupSidebar(self):
-        self.sidebarModel = SidebarModel(db)
+        self.sidebarModel = SidebarModel(
+            self.db, self.worker, self.refresher)
         self.sidebarView.setModel(self.sidebarModel)
-        self.sidebarModel.rowsInserted.connect(self.sidebarView.expandAll)
+        self.sidebarModel.boardAdded.connect(self.sidebarView.expandBoard)
         self.sidebarView.renameList.connect(self.sidebarModel.onRenameList)
         self.sidebarView.renameBoard.connect(self.sidebarModel.onRenameBoard)
         self.sidebarView.deleteList.connect(self.sidebarModel.onDeleteList)
@@ -134,18 +150,57 @@ class MainWidget(QWidget):
         return
 
     def setupCardView(self):
-        self.cardModel = CardModel(self.db)
+        if self.lazyCards:
+            self.cardModel = LazyCardModel(
+                self.db, self.worker, self.refresher)
+        else:
+            self.cardModel = CardModel(self.db, self.worker, self.refresher)
         self.editDialog = CardEditWidget()
         self.cardView.setModel(self.cardModel)
-        self.cardModel.willUpdateCurrentList.connect(self.cardView.storeScrollValue)
         self.cardModel.willUpdateCurrentList.connect(self.cardView.storeSelectedIndex)
-        self.cardModel.updatedCurrentList.connect(self.cardView.restoreScrollValue)
         self.cardModel.updatedCurrentList.connect(self.cardView.restoreSelectedIndex)
         self.sidebarView.listClicked.connect(self.cardModel.showListCards)
-        self.sidebarModel.cardChanged.connect(self.cardModel.refresh)
         self.cardView.showCard.connect(self.editDialog.showCard)
         self.editDialog.cardEdited.connect(self.cardModel.onCardEdited)
-        self.sidebarView.expandAll()
+        # Only the first board's lists are read in at startup
+        self.sidebarView.setExpanded(self.sidebarModel.index(0, 0), True)
+        return
+
+    def setupSearch(self):
+        self.searchModel = SearchModel(self.db)
+        self.searchView.setModel(self.searchModel)
+        self.searchBox.searchRequested.connect(self.searchModel.search)
+        self.searchBox.searchRequested.connect(self.searchView.showFor)
+        self.searchModel.noteChanged.connect(self.searchNote.showNote)
+        self.searchView.cardFound.connect(self.showFoundCard)
+        return
+
+    def setupScheduler(self):
+        # The DueScheduler lives in the worker, next to the writes that
+        # feed it due dates; the timer only asks it to tick
+        self.dueFuture = None
+        self.dueTimer = QTimer(self)
+        self.dueTimer.setSingleShot(True)
+        self.dueTimer.timeout.connect(self.runDueCards)
+        self.worker.resultReady.connect(self.onDueCardsRan)
+        self.dueTimer.start(0)
+        return
+
+    @Slot()
+    def runDueCards(self):
+        self.dueFuture = self.worker.call('runDueCards')
+        return
+
+    @Slot(object)
+    def onDueCardsRan(self, future):
+        if future is not self.dueFuture:
+            return
+        self.dueFuture = None
+        # The models pick up what the due rule did from its changes
+        nextDue = None
+        if future.exception() is None:
+            fired, nextDue = future.result()
+        self.dueTimer.start(int(waitFor(nextDue) * 1000))
         return
 
     def setupNewBoardButton(self):
@@ -153,26 +208,29 @@ class MainWidget(QWidget):
         return
 
     def setupButtonTray(self):
-        self.buttonTray.buttonPressed.connect(self.cardModel.refresh)
-        self.buttonTray.buttonPressed.connect(self.sidebarModel.refresh)
         self.buttonTray.getCurrentList.connect(self.cardModel.currentList)
         self.buttonTray.getSelectedCards.connect(self.cardView.selectedCards)
         return
 
+    @Slot(int, int)
+    def showFoundCard(self, listId, cardId):
+        self.cardModel.showListCards(listId)
+        self.cardView.selectCard(cardId)
+        return
+
     @Slot(str, int)
     def makeNewCard(self, text, listid):
-        self.db.runCommand(f'add-card "{text}":"":-1 to {listid}')
+        self.cardModel.addCard(text, listid)
         return
 
     @Slot()
     def makeNewBoard(self):
-        self.db.runCommand(f'add-board "New Board"')
-        self.sidebarModel.refresh()
+        self.sidebarModel.onAddBoard('New Board')
         return
 
 
 class LisztWindow(QMainWindow):
-    def __init__(self, db, parent=None):
+    def __init__(self, db, worker, lazyCards=False, parent=None):
 
         QMainWindow.__init__(self)
         self.setStyleSheet('''
@@ -180,7 +238,7 @@ class LisztWindow(QMainWindow):
                     background-color: #212121;
                 }
         ''')
-        mainWidget = MainWidget(db)
+        mainWidget = MainWidget(db, worker, lazyCards)
         self.setCentralWidget(mainWidget)
         self.setWindowTitle('Liszt')
         return
@@ -189,7 +247,10 @@ class LisztWindow(QMainWindow):
 if __name__ == "__main__":
     appctxt = ApplicationContext()
     db = Database()
-    mainWin = LisztWindow(db)
+    # Writes go through the worker's connection, reads stay on db
+    worker = DatabaseWorker(db.filename, db.profile)
+    appctxt.app.aboutToQuit.connect(worker.close)
+    mainWin = LisztWindow(db, worker, lazyCards='--lazy-cards' in sys.argv)
     mainWin.resize(1200, 800)
     mainWin.show()
     sys.exit(appctxt.app.exec_())
@@ -0,0 +1,115 @@
+'''
+Per-verb latency of the commands a Database runs. Timings go into a
+log-linear histogram with a fixed number of buckets, so recording costs
+the same however many commands have run and percentiles are read off it
+to within one bucket.
+'''
+import collections
+
+# Bits of each timing kept below its leading bit. Each power of two is
+# split into 2**HISTOGRAM_SUB_BITS buckets, so a percentile is off by at
+# most 1/16 of the value.
+HISTOGRAM_SUB_BITS = 3
+
+# Timings above this many ns go in the last bucket (about 18 minutes)
+HISTOGRAM_MAX_NS = 2**40
+
+# Percentiles reported per verb
+PERCENTILES = (50, 95, 99)
+
+
+def bucketOf(ns):
+    '''
+    Histogram bucket of a timing in ns. Values below
+    2**(HISTOGRAM_SUB_BITS + 1) get a bucket each.
+    '''
+    ns = min(max(ns, 0), HISTOGRAM_MAX_NS)
+    shift = max(ns.bit_length() - HISTOGRAM_SUB_BITS - 1, 0)
+    return (shift << HISTOGRAM_SUB_BITS) + (ns >> shift)
+
+
+def bucketMidpoint(bucket):
+    '''
+    The ns value a bucket stands for
+    '''
+    shift = max((bucket >> HISTOGRAM_SUB_BITS) - 1, 0)
+    low = (bucket - (shift << HISTOGRAM_SUB_BITS)) << shift
+    return low + ((1 << shift) - 1) / 2
+
+
+class VerbStats:
+    '''
+    Timings of one verb: how often it ran, for how long in all, the
+    histogram, the rows it wrote and the time spent committing them.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.totalNs = 0
+        self.rows = 0
+        self.commits = 0
+        self.commitNs = 0
+        self.histogram = collections.Counter()
+        return
+
+    def add(self, ns, rows, commitNs=None):
+        self.count += 1
+        self.totalNs += ns
+        self.rows += rows
+        if commitNs is not None:
+            self.commits += 1
+            self.commitNs += commitNs
+        self.histogram[bucketOf(ns)] += 1
+        return
+
+    def percentile(self, q):
+        '''
+        The timing in ns that q percent of the runs took at most
+        '''
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return bucketMidpoint(bucket)
+        return 0
+
+    def asDict(self):
+        stats = {
+            'count': self.count,
+            'totalMs': round(self.totalNs / 1e6, 3),
+        }
+        for q in PERCENTILES:
+            stats[f'p{q}Ms'] = round(self.percentile(q) / 1e6, 3)
+        stats['rows'] = self.rows
+        meanCommitNs = self.commitNs / self.commits if self.commits else 0
+        stats['commitMs'] = round(meanCommitNs / 1e6, 3)
+        return stats
+
+
+class CommandProfiler:
+    '''
+    VerbStats by verb, filled in by Database.runCommand
+    '''
+    def __init__(self):
+        self.reset()
+        return
+
+    def reset(self):
+        self.verbs = collections.defaultdict(VerbStats)
+        return
+
+    def record(self, verb, ns, rows, commitNs=None):
+        '''
+        commitNs is None for a command run inside an outer batch, which
+        commits for it
+        '''
+        self.verbs[verb].add(ns, rows, commitNs)
+        return
+
+    def asDict(self):
+        '''
+        Stats of every verb that ran, the slowest in all first
+        '''
+        verbs = sorted(
+            self.verbs.items(), key=lambda item: -item[1].totalNs)
+        return {verb: stats.asDict() for verb, stats in verbs}
@@ -0,0 +1,171 @@
+'''
+Logs the SQL statements a Database connection runs for longer than a
+threshold, with the command that ran them and their query plan. sqlite
+reports each statement as it starts (set_trace_callback). A statement
+runs until the call into sqlite that started it returns, waits on locks
+and disk included, or until the last of the progress callbacks sqlite
+makes every SLOW_QUERY_CHECK_OPS virtual machine steps
+(set_progress_handler) while its rows are fetched afterwards. Time
+spent in Python between statements is not counted.
+'''
+import contextlib
+import logging
+import logging.handlers
+import sqlite3
+import time
+
+# File the slow statements are written to, rotated once it gets to
+# SLOW_QUERY_LOG_BYTES with SLOW_QUERY_LOG_BACKUPS older files kept
+SLOW_QUERY_LOG = 'slow-queries.log'
+SLOW_QUERY_LOG_BYTES = 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+
+# Virtual machine steps between two progress callbacks, which time the
+# rows of a statement fetched after the call that started it returned
+SLOW_QUERY_CHECK_OPS = 1000
+
+
+class SlowQueryLog:
+    '''
+    Times the statements run on conn and writes the ones that took at
+    least thresholdMs to path. Entries are queued by the callbacks and
+    written by flush(), since sqlite does not allow running the EXPLAIN
+    QUERY PLAN from inside a callback.
+    '''
+    def __init__(self, conn, thresholdMs, path=SLOW_QUERY_LOG):
+        self.conn = conn
+        self.thresholdNs = int(thresholdMs * 1e6)
+        # Verb of the command running, None for calls from outside one
+        self.verb = None
+        # (verb, sql, start, lastStep) of the statement running
+        self.current = None
+        # (verb, sql, elapsedNs) of slow statements not written yet
+        self.queued = []
+        # Set while flush runs its own statements, which are not timed
+        self.explaining = False
+
+        self.logger = logging.getLogger(f'{__name__}.{path}')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=SLOW_QUERY_LOG_BYTES,
+                backupCount=SLOW_QUERY_LOG_BACKUPS)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self.logger.addHandler(handler)
+
+        conn.set_trace_callback(self.onStatement)
+        conn.set_progress_handler(self.onStep, SLOW_QUERY_CHECK_OPS)
+        return
+
+    @contextlib.contextmanager
+    def running(self, verb):
+        '''
+        Tags the statements run inside the block with verb. They are
+        written once the outermost command is done.
+        '''
+        outerVerb, self.verb = self.verb, verb
+        try:
+            yield
+        finally:
+            self.verb = outerVerb
+            if outerVerb is None:
+                self.finish()
+                self.flush()
+        return
+
+    def nextStatement(self):
+        '''
+        Called by the Database before each statement it runs. Closes the
+        statement before, so running the same text again is timed apart.
+        '''
+        self.finish()
+        self.flush()
+        return
+
+    def onStatement(self, sql):
+        if self.explaining:
+            return
+        # Statements run by virtual tables come as comments, and every
+        # trigger or foreign key action a statement sets off reports its
+        # text again. Their time counts towards the statement itself.
+        if sql.startswith('--'):
+            return
+        if self.current is not None and self.current[1] == sql:
+            return
+        self.finish()
+        now = time.perf_counter_ns()
+        self.current = [self.verb, sql, now, now]
+        return
+
+    def stepped(self):
+        '''
+        Called by the Database when a call into sqlite returns, whether
+        it ran a statement or committed
+        '''
+        if self.current is not None:
+            self.current[3] = time.perf_counter_ns()
+        return
+
+    def onStep(self):
+        if self.current is not None and not self.explaining:
+            self.current[3] = time.perf_counter_ns()
+        # Anything but 0 would abort the statement
+        return 0
+
+    def finish(self):
+        '''
+        Queues the statement that ran last if it was slow
+        '''
+        if self.current is None:
+            return
+        verb, sql, start, lastStep = self.current
+        self.current = None
+        elapsed = lastStep - start
+        if elapsed >= self.thresholdNs:
+            self.queued.append((verb, sql, elapsed))
+        return
+
+    def flush(self):
+        '''
+        Writes the queued statements with their query plans. Those of a
+        command still running wait for it to be done.
+        '''
+        if not self.queued or self.verb is not None:
+            return
+        queued, self.queued = self.queued, []
+        self.explaining = True
+        try:
+            for verb, sql, elapsed in queued:
+                # One line per statement, however the SQL is laid out
+                text = ' '.join(sql.split())
+                lines = [f'{elapsed / 1e6:.3f} ms {verb or "-"}: {text}']
+                lines += [f'    {step}' for step in self.queryPlan(sql)]
+                self.logger.info('\n'.join(lines))
+        finally:
+            self.explaining = False
+        return
+
+    def queryPlan(self, sql):
+        '''
+        EXPLAIN QUERY PLAN of sql, one line per step indented by depth
+        '''
+        if sql.lstrip().upper().startswith(('BEGIN', 'COMMIT', 'ROLLBACK')):
+            return []
+        try:
+            rows = self.conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+        except sqlite3.Error as e:
+            return [f'no plan: {e}']
+        depths = {0: 0}
+        plan = []
+        for stepId, parentId, _, detail in rows:
+            depths[stepId] = depths.get(parentId, 0) + 1
+            plan.append('  ' * (depths[stepId] - 1) + detail)
+        return plan
+
+    def close(self):
+        self.finish()
+        self.flush()
+        self.conn.set_trace_callback(None)
+        self.conn.set_progress_handler(None, 0)
+        return
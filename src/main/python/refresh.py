@@ -0,0 +1,47 @@
+from PySide2.QtCore import (
+    QObject,
+    QTimer,
+    Slot,
+)
+
+
+class RefreshScheduler(QObject):
+    '''
+    Coalesces model reloads. request(callback) marks a reload as due;
+    each one that is due runs once, when control gets back to the event
+    loop, however many times it was requested before that.
+    '''
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        # Reloads due, in the order they were first requested
+        self.dirty = {}
+        self.requested = 0
+        self.executed = 0
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.run)
+        return
+
+    def request(self, callback):
+        self.requested += 1
+        self.dirty[callback] = None
+        if not self.timer.isActive():
+            self.timer.start()
+        return
+
+    @Slot()
+    def run(self):
+        # A reload may request more, those wait for the next turn
+        dirty, self.dirty = self.dirty, {}
+        for callback in dirty:
+            self.executed += 1
+            callback()
+        return
+
+    def stats(self):
+        return {
+            'requested': self.requested,
+            'executed': self.executed,
+            'coalesced': self.requested - self.executed - len(self.dirty),
+        }
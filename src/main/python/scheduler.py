@@ -0,0 +1,151 @@
+'''
+Runs the due rule on cards as their due dates pass. Upcoming deadlines
+sit in a min-heap read a slice at a time off the cardsByDueDate index, so
+a tick only touches the cards that came due, however many cards exist.
+'''
+import heapq
+import time
+
+# Deadlines read off the index per refill of the heap
+SCHEDULER_SEED_SIZE = 1024
+
+# Longest wait, in seconds, between two ticks. A due date set on another
+# connection never reaches the heap; each tick reads the cards that came
+# due off the index too, so the timer never sleeps past this.
+SCHEDULER_MAX_WAIT = 5
+
+
+class DueScheduler:
+    '''
+    Heap of (dueDate, cardId) for the deadlines of one Database. The heap
+    holds every deadline after checkedUntil up to horizon, the last key
+    read off the index; later ones are read once the heap runs dry.
+    Entries are never updated in place, an entry whose card has since
+    got a new due date or been deleted is dropped when it comes up.
+    The heap gives the next deadline to wait for; what fires on a tick
+    is also read off the index, for due dates set on other connections.
+    '''
+    def __init__(self, db, now=None):
+        self.db = db
+        if now is None:
+            now = int(time.time())
+        # Deadlines up to here have had the rule run on them already. A
+        # db that never ran the scheduler starts from now, so old overdue
+        # cards do not all fire at once.
+        self.checkedUntil = int(db.getSetting('dueCheckedUntil', now))
+        self.reset()
+        return
+
+    def refill(self):
+        # Deadlines up to checkedUntil have fired, including the ones
+        # dueDateSet pushed without moving the horizon past them
+        self.horizon = max(self.horizon, (self.checkedUntil + 1, 0))
+        rows = self.db.dueCardsAfter(self.horizon, SCHEDULER_SEED_SIZE)
+        for row in rows:
+            heapq.heappush(self.heap, row)
+        if rows:
+            self.horizon = rows[-1]
+        self.exhausted = len(rows) < SCHEDULER_SEED_SIZE
+        return
+
+    def dueDateSet(self, cardId, dueDate):
+        '''
+        Called by the Database whenever a card gets a due date
+        '''
+        if dueDate <= 0:
+            return
+        entry = (dueDate, cardId)
+        # Past the horizon the index will hand it over on a later refill
+        if self.exhausted or entry <= self.horizon:
+            heapq.heappush(self.heap, entry)
+        return
+
+    def reset(self):
+        '''
+        Forgets the heap, e.g. after an import added cards in bulk
+        '''
+        self.heap = []
+        # Last (dueDate, cardId) read off the index
+        self.horizon = (self.checkedUntil + 1, 0)
+        self.exhausted = False
+        return
+
+    def nextDue(self):
+        '''
+        The earliest deadline still waiting, None if there is none
+        '''
+        if not self.heap:
+            self.refill()
+        return self.heap[0][0] if self.heap else None
+
+    def popDue(self, now):
+        '''
+        Takes every entry due by now off the heap and returns the
+        (dueDate, cardId) of the cards whose due date is still the one
+        the entry was made for, with the cards the index has due since
+        checkedUntil
+        '''
+        entries = {}
+        while True:
+            if not self.heap:
+                self.refill()
+            if not self.heap or self.heap[0][0] > now:
+                break
+            dueDate, cardId = heapq.heappop(self.heap)
+            entries[cardId] = dueDate
+        if entries:
+            current = self.db.cardDueDates(entries.keys())
+            entries = {cardId: dueDate for cardId, dueDate in entries.items()
+                       if current.get(cardId) == dueDate}
+
+        after = (self.checkedUntil + 1, 0)
+        while True:
+            rows = self.db.dueCardsAfter(after, SCHEDULER_SEED_SIZE, now)
+            for dueDate, cardId in rows:
+                entries[cardId] = dueDate
+            if len(rows) < SCHEDULER_SEED_SIZE:
+                break
+            after = rows[-1]
+        return sorted((dueDate, cardId) for cardId, dueDate in entries.items())
+
+    def tick(self, now=None):
+        '''
+        Runs the due rule on the cards that came due since the last tick.
+        Returns how many did and the next deadline.
+        '''
+        if now is None:
+            now = int(time.time())
+        entries = self.popDue(now)
+        if entries:
+            try:
+                with self.db.batch():
+                    self.db.runDueRule([cardId for _, cardId in entries])
+                    self.db.setSetting('dueCheckedUntil', now)
+            except Exception:
+                # Rolled back, the next tick runs the rule on them again
+                for entry in entries:
+                    heapq.heappush(self.heap, entry)
+                raise
+        self.checkedUntil = max(self.checkedUntil, now)
+        return len(entries), self.nextDue()
+
+    def run(self, log=print):
+        '''
+        Ticks until interrupted, for running without the GUI
+        '''
+        while True:
+            fired, nextDue = self.tick()
+            if fired:
+                log(f'Due rule ran on {fired} cards')
+            time.sleep(waitFor(nextDue))
+
+
+def waitFor(nextDue, now=None):
+    '''
+    Seconds to sleep before the tick that should handle nextDue
+    '''
+    if now is None:
+        now = time.time()
+    if nextDue is None:
+        return SCHEDULER_MAX_WAIT
+    return min(max(nextDue - now, 0), SCHEDULER_MAX_WAIT)
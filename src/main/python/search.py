@@ -0,0 +1,153 @@
+from PySide2.QtWidgets import (
+    QLabel,
+    QLineEdit,
+    QListView,
+)
+from PySide2.QtGui import (
+    QStandardItemModel,
+    QStandardItem,
+)
+from PySide2.QtCore import (
+    QModelIndex,
+    QTimer,
+    Signal,
+    Slot,
+)
+
+from database import SEARCH_PAGE_SIZE, SEARCH_RANK_WINDOW
+
+# Pause in typing, in ms, before the search box runs a query
+SEARCH_DELAY = 150
+
+# Shown under the search box when the results are not ranked all at once
+SEARCH_WINDOW_NOTE = (
+    f'Over {SEARCH_RANK_WINDOW:,} matches: best first within each'
+    f' {SEARCH_RANK_WINDOW:,}, newest first. Add a word to rank them all.')
+
+
+class SearchHit(QStandardItem):
+    def __init__(self, row):
+        QStandardItem.__init__(self)
+        self.itemType = 'SEARCH'
+        self.rowid = row.cardId
+        self.listId = row.listId
+        self.setText(f'{row.title}\n{row.boardTitle} / {row.listTitle}')
+        self.setEditable(False)
+        return
+
+
+class SearchModel(QStandardItemModel):
+    '''
+    Search results, read a page at a time as the view scrolls down
+    '''
+    noteChanged = Signal(str)
+
+    def __init__(self, db):
+        QStandardItemModel.__init__(self, parent=None)
+        self.db = db
+        self.text = ''
+        self.exhausted = True
+        return
+
+    @Slot(str)
+    def search(self, text):
+        self.clear()
+        self.text = text
+        self.exhausted = False
+        windowed = self.db.searchIsWindowed(text)
+        self.noteChanged.emit(SEARCH_WINDOW_NOTE if windowed else '')
+        self.fetchMore(QModelIndex())
+        return
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        rows = self.db.searchCards(
+            self.text, SEARCH_PAGE_SIZE, self.rowCount())
+        for row in rows:
+            self.appendRow(SearchHit(row))
+        self.exhausted = len(rows) < SEARCH_PAGE_SIZE
+        return
+
+
+class SearchBox(QLineEdit):
+    '''
+    Runs a search once typing pauses
+    '''
+    searchRequested = Signal(str)
+
+    def __init__(self, parent=None):
+        QLineEdit.__init__(self)
+        self.setPlaceholderText('Search cards')
+        self.setClearButtonEnabled(True)
+        self.setStyleSheet('''
+            QLineEdit {
+                background-color: #2a2a2a;
+                color: #cccccc;
+            }; ''')
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(SEARCH_DELAY)
+        self.timer.timeout.connect(self.sendSearch)
+        self.textChanged.connect(self.timer.start)
+        self.returnPressed.connect(self.sendSearch)
+        return
+
+    @Slot()
+    def sendSearch(self):
+        self.timer.stop()
+        self.searchRequested.emit(self.text())
+        return
+
+
+class SearchView(QListView):
+    cardFound = Signal(int, int)  # (listId, cardId)
+
+    def __init__(self, parent=None):
+        QListView.__init__(self)
+        self.setStyleSheet('''
+                QListView {
+                    font-size: 11pt;
+                    background-color: #2e2e2e;
+                    color: #cccccc;
+                }
+                ''')
+        self.setWordWrap(True)
+        self.clicked.connect(self.onClick)
+        return
+
+    @Slot(QModelIndex)
+    def onClick(self, index):
+        hit = self.model().itemFromIndex(index)
+        self.cardFound.emit(hit.listId, hit.rowid)
+        return
+
+    @Slot(str)
+    def showFor(self, text):
+        self.setVisible(bool(text.strip()))
+        return
+
+
+class SearchNote(QLabel):
+    '''
+    Says how the search results are ordered when it is not by relevance
+    '''
+    def __init__(self, parent=None):
+        QLabel.__init__(self)
+        self.setWordWrap(True)
+        self.setStyleSheet('''
+            QLabel {
+                font-size: 9pt;
+                color: #999999;
+            }; ''')
+        self.hide()
+        return
+
+    @Slot(str)
+    def showNote(self, text):
+        self.setText(text)
+        self.setVisible(bool(text))
+        return
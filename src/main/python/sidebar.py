@@ -1,5 +1,3 @@
-import io
-import csv
 from PySide2.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -26,44 +24,88 @@ from PySide2.QtCore import (
     QFile,
     QPoint,
     QMimeData,
+    QModelIndex,
     Signal,
     Slot,
 )
-from database import encodeForDB, decodeFromDB
+
+from database import (
+    LISTS_INSERTED,
+    LISTS_RENAMED,
+    LISTS_MOVED,
+    LISTS_DELETED,
+    BOARDS_INSERTED,
+    BOARDS_RENAMED,
+    BOARDS_MOVED,
+    BOARDS_DELETED,
+    RESET,
+)
+from worker import PendingWrites
 
 
 def getBoards(db):
-    result = db.runCommand('show-boards')
-    boards = []
-    with io.StringIO(result) as f:
-        reader = csv.DictReader(f, delimiter='\t')
-        for idx, row in enumerate(reader):
-            board = Board(row['title'], row['id'], idx)
-            boards.append(board)
-    return boards
+    return [
+        Board(board.title, board.id, idx)
+        for idx, board in enumerate(db.allBoards())]
 
 
 def getLists(db, boardId):
     if boardId == -1:
         return []
-    result = db.runCommand(f'show-lists {boardId}')
-    lists = []
-    with io.StringIO(result) as f:
-        reader = csv.DictReader(f, delimiter='\t')
-        for idx, row in enumerate(reader):
-            _list = List(decodeFromDB(row['title']), row['id'], idx)
-            lists.append(_list)
-    return lists
+    return [
+        List(_list.title, _list.id, idx)
+        for idx, _list in enumerate(db.boardLists(boardId))]
+
+
+def syncChildren(parent, rows, makeItem):
+    '''
+    Brings the children of parent in line with rows of (rowid, title),
+    keyed on rowid. Items already there are kept, so boards stay
+    expanded. Returns the items that had to be made.
+    '''
+    wanted = {rowid for rowid, _ in rows}
+    for rowNum in reversed(range(parent.rowCount())):
+        if parent.child(rowNum).rowid not in wanted:
+            parent.removeRow(rowNum)
+
+    made = []
+    for rowNum, (rowid, title) in enumerate(rows):
+        item = parent.child(rowNum)
+        if item is None or item.rowid != rowid:
+            found = None
+            for otherRow in range(rowNum + 1, parent.rowCount()):
+                if parent.child(otherRow).rowid == rowid:
+                    found = otherRow
+                    break
+            if found is None:
+                item = makeItem(title, rowid, rowNum)
+                made.append(item)
+            else:
+                item = parent.takeRow(found)[0]
+            # The list form, a lone item is not handed over to the parent
+            # and is deleted with its Python wrapper
+            parent.insertRow(rowNum, [item])
+        item.setName(title)
+        item.idx = rowNum
+    return made
 
 
 class Board(QStandardItem):
     def __init__(self, name, rowid, idx):
         QStandardItem.__init__(self)
         self.itemType = 'BOARD'
-        self.name = decodeFromDB(name)
+        self.name = name
         self.rowid = int(rowid)
         self.setText(f'#{rowid}  {name}')
         self.idx = int(idx)
+        # Lists are only read in once the board is first expanded
+        self.loaded = False
+
+    def setName(self, name):
+        if name != self.name:
+            self.name = name
+            self.setText(f'#{self.rowid}  {name}')
+        return
 
     def __str__(self):
         return f'{self.itemType}::{self.rowid}::{self.idx}::{self.name}'
@@ -76,11 +118,17 @@ class List(QStandardItem):
     def __init__(self, name, rowid, idx):
         QStandardItem.__init__(self)
         self.itemType = 'LIST'
-        self.name = decodeFromDB(name)
+        self.name = name
         self.rowid = int(rowid)
         self.setText(f'#{rowid}  {name}')
         self.idx = int(idx)
 
+    def setName(self, name):
+        if name != self.name:
+            self.name = name
+            self.setText(f'#{self.rowid}  {name}')
+        return
+
     def __str__(self):
         return f'{self.itemType}::{self.rowid}::{self.idx}::{self.name}'
 
@@ -271,6 +319,15 @@ class SidebarView(QTreeView):
             self.listClicked.emit(int(item.rowid))
         return
 
+    @Slot(int)
+    def expandBoard(self, rowid):
+        model = self.model()
+        for i in range(model.rowCount()):
+            if model.item(i, 0).rowid == rowid:
+                self.setExpanded(model.index(i, 0), True)
+                break
+        return
+
     @Slot()
     def storeExpanded(self):
         self.expanded = {}
@@ -286,7 +343,7 @@ class SidebarView(QTreeView):
         for i in range(model.rowCount()):
             rowIdx = model.index(i, 0)
             item = model.item(i, 0)
-            self.setExpanded(rowIdx, self.expanded[item.rowid])
+            self.setExpanded(rowIdx, self.expanded.get(item.rowid, False))
 
     @Slot()
     def storeScrollValue(self):
@@ -298,24 +355,137 @@ class SidebarView(QTreeView):
         self.verticalScrollBar().setValue(self.scrollValue)
 
 class SidebarModel(QStandardItemModel):
-    cardChanged = Signal()
+    '''
+    Boards, each with its lists. Only the boards are read up front; the
+    lists of a board are read when the view first expands it, and kept
+    up to date by change events until the next refresh.
+    '''
     willRefresh = Signal()
     refreshed = Signal()
+    boardAdded = Signal(int)
 
-    def __init__(self, db):
+    def __init__(self, db, worker, refresher):
         QStandardItemModel.__init__(self, parent=None)
         self.db = db
+        self.worker = worker
+        self.writes = PendingWrites(worker, refresher, self.refresh, self)
+        self.worker.changesReady.connect(self.onChanges)
         self.refresh()
         return
 
+    @Slot(object)
+    def onChanges(self, changes):
+        '''
+        Applies what a write changed in the tree. Renames and deletes are
+        done in place; added or moved lists re-read the lists of their
+        boards, added or moved boards the board order.
+        '''
+        renamed = {'LIST': set(), 'BOARD': set()}
+        syncedBoards = set()
+        syncBoards = False
+        for change in changes:
+            if change.kind == RESET:
+                self.writes.stale = True
+            elif change.kind == LISTS_RENAMED:
+                renamed['LIST'].update(change.ids)
+            elif change.kind == BOARDS_RENAMED:
+                renamed['BOARD'].update(change.ids)
+            elif change.kind in (LISTS_INSERTED, LISTS_MOVED):
+                syncedBoards.update(change.parentIds)
+            elif change.kind in (BOARDS_INSERTED, BOARDS_MOVED):
+                syncBoards = True
+            elif change.kind == LISTS_DELETED:
+                for rowid in change.ids:
+                    self.removeItem('LIST', rowid)
+            elif change.kind == BOARDS_DELETED:
+                for rowid in change.ids:
+                    self.removeItem('BOARD', rowid)
+
+        if self.writes.stale:
+            self.writes.requestReload()
+            return
+        if syncBoards:
+            self.syncBoards()
+        for boardId in syncedBoards:
+            self.syncLists(boardId)
+        for itemType, table in (('LIST', 'lists'), ('BOARD', 'boards')):
+            if renamed[itemType]:
+                titles = self.db.titles(table, renamed[itemType])
+                for rowid, title in titles.items():
+                    item = self.findItem(itemType, rowid)
+                    if item is not None:
+                        item.setName(title)
+        return
+
+    def removeItem(self, itemType, rowid):
+        item = self.findItem(itemType, rowid)
+        if item is None:
+            return
+        if itemType == 'BOARD':
+            self.removeRow(item.row())
+        else:
+            item.parent().removeRow(item.row())
+        return
+
+    def syncBoards(self):
+        rows = [(board.id, board.title) for board in self.db.allBoards()]
+        rootNode = self.invisibleRootItem()
+        for board in syncChildren(rootNode, rows, Board):
+            self.boardAdded.emit(board.rowid)
+        return
+
+    def syncLists(self, boardId):
+        board = self.findItem('BOARD', boardId)
+        # A board not read in yet gets its lists fresh once it is
+        if board is not None and board.loaded:
+            self.loadLists(board)
+        return
+
+    def loadLists(self, board):
+        listIds = self.db.listsInBoard(board.rowid)
+        titles = self.db.titles('lists', listIds)
+        rows = [(listId, titles[listId]) for listId in listIds]
+        syncChildren(board, rows, List)
+        board.loaded = True
+        return
+
+    def hasChildren(self, parent=QModelIndex()):
+        item = self.itemFromIndex(parent)
+        if type(item) == Board and not item.loaded:
+            # Keeps the expand arrow up before the lists are read in
+            return True
+        return QStandardItemModel.hasChildren(self, parent)
+
+    def canFetchMore(self, parent):
+        item = self.itemFromIndex(parent)
+        return type(item) == Board and not item.loaded
+
+    def fetchMore(self, parent):
+        item = self.itemFromIndex(parent)
+        if type(item) == Board and not item.loaded:
+            self.loadLists(item)
+        return
+
+    def findItem(self, itemType, rowid):
+        rootNode = self.invisibleRootItem()
+        for boardRow in range(rootNode.rowCount()):
+            board = rootNode.child(boardRow)
+            if itemType == 'BOARD' and board.rowid == rowid:
+                return board
+            for listRow in range(board.rowCount()):
+                _list = board.child(listRow)
+                if itemType == 'LIST' and _list.rowid == rowid:
+                    return _list
+        return None
+
     def refresh(self):
+        if self.writes.holdReload():
+            return
         self.willRefresh.emit()
         self.clear()
         rootNode = self.invisibleRootItem()
         for board in getBoards(self.db):
             rootNode.appendRow(board)
-            for _list in getLists(self.db, board.rowid):
-                board.appendRow(_list)
         self.refreshed.emit()
         return
 
@@ -324,10 +494,8 @@ class SidebarModel(QStandardItemModel):
         result = False
         if type(target) == List and 'CARD' in data.text():
             # A card being dropped on a list
-            cardId = data.text().split('::')[1]
-            cmd = f'move-card {cardId} to {target.rowid}'
-            self.db.runCommand(cmd)
-            self.cardChanged.emit()
+            cardId = int(data.text().split('::')[1])
+            self.writes.submit('moveCardToList', cardId, target.rowid)
             result = True
 
         elif type(target) == Board and 'LIST' in data.text():
@@ -344,9 +512,13 @@ class SidebarModel(QStandardItemModel):
             else:
                 newIdx = row - 1
 
-            cmd = f'shift-list {listId} to {newIdx}'
-            self.db.runCommand(cmd)
-            self.refresh()
+            _list = target.child(listIdx)
+            if _list is not None and _list.rowid == listId:
+                target.takeRow(listIdx)
+                target.insertRow(newIdx, [_list])
+                for listRow in range(target.rowCount()):
+                    target.child(listRow).idx = listRow
+            self.writes.submit('placeList', listId, newIdx)
             result = True
 
         elif target is None and 'BOARD' in data.text():
@@ -376,37 +548,46 @@ class SidebarModel(QStandardItemModel):
 
     @Slot(str, int)
     def onRenameList(self, name, rowid):
-        cmd = f'rename-list {rowid} "{name}"'
-        self.db.runCommand(cmd)
-        self.refresh()
+        _list = self.findItem('LIST', rowid)
+        if _list is not None:
+            _list.name = name
+            _list.setText(f'#{rowid}  {name}')
+        self.writes.submit('updateList', rowid, name)
         return
 
     @Slot(str, int)
     def onRenameBoard(self, name, rowid):
-        cmd = f'rename-board {rowid} "{name}"'
-        self.db.runCommand(cmd)
-        self.refresh()
+        board = self.findItem('BOARD', rowid)
+        if board is not None:
+            board.name = name
+            board.setText(f'#{rowid}  {name}')
+        self.writes.submit('updateBoard', rowid, name)
         return
 
     @Slot(int)
     def onDeleteList(self, rowid):
-        cmd = f'delete-list {rowid}'
-        self.db.runCommand(cmd)
-        self.refresh()
+        _list = self.findItem('LIST', rowid)
+        if _list is not None:
+            _list.parent().removeRow(_list.row())
+        self.writes.submit('removeList', rowid)
         return
 
     @Slot(int)
     def onDeleteBoard(self, rowid):
-        cmd = f'delete-board {rowid}'
-        self.db.runCommand(cmd)
-        self.refresh()
+        board = self.findItem('BOARD', rowid)
+        if board is not None:
+            self.removeRow(board.row())
+        self.writes.submit('removeBoard', rowid)
         return
 
     @Slot(str, int)
     def onAddList(self, name, boardid):
-        cmd = f'add-list "{name}" to {boardid}'
-        self.db.runCommand(cmd)
-        self.refresh()
+        self.writes.submit('insertList', name, boardid)
+        return
+
+    @Slot(str)
+    def onAddBoard(self, name):
+        self.writes.submit('insertBoard', name)
         return
 
     def mimeData(self, indexes):
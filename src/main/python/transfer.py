@@ -0,0 +1,63 @@
+'''
+JSON Lines and CSV files of the records Database.exportRecords yields
+and Database.importRecords takes. Both directions stream, one record at
+a time, so file size does not matter.
+'''
+import csv
+import json
+import os
+
+# Columns of a CSV file. JSON Lines records use the same keys but leave
+# out the ones a record type has no use for.
+FIELDS = ('type', 'id', 'parent', 'title', 'content', 'dueDate')
+INT_FIELDS = ('id', 'parent', 'dueDate')
+
+
+def fileFormat(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if ext == '.csv':
+        return 'csv'
+    raise ValueError(f'Unknown file format, use .jsonl or .csv: {path}')
+
+
+def writeRecords(records, path):
+    '''
+    Writes records to path in the format its extension names, returns
+    how many were written
+    '''
+    count = 0
+    fmt = fileFormat(path)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, FIELDS)
+            writer.writeheader()
+            for record in records:
+                writer.writerow(record)
+                count += 1
+        else:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write('\n')
+                count += 1
+    return count
+
+
+def readRecords(path):
+    '''
+    Yields the records stored in path
+    '''
+    fmt = fileFormat(path)
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            for record in csv.DictReader(f):
+                for field in INT_FIELDS:
+                    value = record.get(field)
+                    record[field] = int(value) if value else None
+                yield record
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    return
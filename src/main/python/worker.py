@@ -0,0 +1,146 @@
+import concurrent.futures
+import logging
+import queue
+import threading
+
+from PySide2.QtCore import (
+    QObject,
+    Signal,
+    Slot,
+)
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseWorker(QObject):
+    '''
+    Runs database writes on a thread of their own so the GUI never waits
+    on a commit. The thread opens its own connection to the file, jobs run
+    one at a time in the order they were submitted.
+
+    Every job returns a Future. resultReady(future) is emitted once it is
+    done; slots on GUI objects receive it on the GUI thread, after the
+    write is committed and visible to the GUI's own connection. It is
+    followed by changesReady(changes), the database.Change records of
+    everything the job committed, possibly none.
+    '''
+    resultReady = Signal(object)
+    changesReady = Signal(object)
+
+    def __init__(self, filename='data.db', profile='safe'):
+        QObject.__init__(self)
+        # The GUI's Database should be opened first, it creates the file
+        self.filename = filename
+        self.profile = profile
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(
+            target=self.run, name='DatabaseWorker', daemon=True)
+        self.thread.start()
+        return
+
+    def submit(self, cmd):
+        '''
+        Queues a command, the future resolves to what runCommand returns
+        '''
+        return self.call('runCommand', cmd)
+
+    def call(self, method, *args, **kwargs):
+        '''
+        Queues a call to a Database method by name, e.g.
+        call('placeCard', 12, 0)
+        '''
+        future = concurrent.futures.Future()
+        self.jobs.put((future, method, args, kwargs))
+        return future
+
+    def close(self):
+        '''
+        Finishes the queued jobs and closes the connection
+        '''
+        self.jobs.put(None)
+        self.thread.join()
+        return
+
+    def run(self):
+        db = Database(self.filename, self.profile)
+        changes = []
+        db.subscribe(changes.extend)
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            future, method, args, kwargs = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = getattr(db, method)(*args, **kwargs)
+                except Exception as e:
+                    logger.warning(f'{method}{args} failed', exc_info=True)
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            self.resultReady.emit(future)
+            self.changesReady.emit(list(changes))
+            changes.clear()
+        db.close()
+        return
+
+
+class PendingWrites(QObject):
+    '''
+    The writes a model sent to the worker that have not landed yet. The
+    model shows them optimistically, so a reload while any are pending
+    would undo them: it is put off, the model is marked stale, and
+    reload is requested from the refresher once the last one lands. A
+    write that failed marks the model stale too, so the reload puts its
+    optimistic edit back the way the database has it.
+
+    Connect the worker's changesReady after creating this, so the write
+    a change comes from has landed by the time the model hears of it.
+    '''
+    def __init__(self, worker, refresher, reload, parent=None):
+        QObject.__init__(self, parent)
+        self.worker = worker
+        self.refresher = refresher
+        self.reload = reload
+        self.futures = set()
+        self.stale = False
+        self.worker.resultReady.connect(self.onResultReady)
+        return
+
+    def __bool__(self):
+        return bool(self.futures)
+
+    def submit(self, method, *args):
+        self.futures.add(self.worker.call(method, *args))
+        return
+
+    @Slot(object)
+    def onResultReady(self, future):
+        if future in self.futures:
+            self.futures.discard(future)
+            if future.exception() is not None:
+                self.stale = True
+        return
+
+    def holdReload(self):
+        '''
+        Called by reload before it reads anything. True when writes are
+        pending, the reload has to wait for them; otherwise the model is
+        about to be fresh.
+        '''
+        if self.futures:
+            self.stale = True
+            return True
+        self.stale = False
+        return False
+
+    def requestReload(self):
+        '''
+        Has the refresher run reload if the model is stale and nothing is
+        pending any more
+        '''
+        if self.stale and not self.futures:
+            self.refresher.request(self.reload)
+        return
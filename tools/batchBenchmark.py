@@ -0,0 +1,49 @@
+'''
+Times BATCH_COMMANDS set-due-date commands on a database file, each
+committing on its own, then all of them committed at once by runCommands.
+Every commit waits on the disk, so the difference is the cost of the
+fsyncs saved.
+
+    python tools/batchBenchmark.py [profile]
+
+profile is the connection profile, 'safe' by default.
+'''
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'main', 'python'))
+
+from database import Database
+
+BATCH_COMMANDS = 500
+
+
+def main(profile):
+    with tempfile.TemporaryDirectory() as scratch:
+        db = Database(os.path.join(scratch, 'batch.db'), profile=profile)
+        with db.batch():
+            cardIds = [db.insertCard(f'card {i}', 1)
+                       for i in range(BATCH_COMMANDS)]
+
+        start = time.perf_counter()
+        for cardId in cardIds:
+            db.runCommand(f'set-due-date {cardId} 1700000000')
+        each = time.perf_counter() - start
+
+        start = time.perf_counter()
+        db.runCommands(
+            [f'set-due-date {cardId} 1800000000' for cardId in cardIds])
+        once = time.perf_counter() - start
+        db.close()
+
+    print(f'{BATCH_COMMANDS} set-due-date commands, {profile} profile:')
+    print(f'    {BATCH_COMMANDS} commits: {each * 1000:8.1f} ms')
+    print(f'    1 commit:    {once * 1000:8.1f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else 'safe'))
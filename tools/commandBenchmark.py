@@ -0,0 +1,57 @@
+'''
+Commands per second runCommand dispatches: a mix of point commands, the
+kind buttons and card edits send, run over and over on an in-memory
+database.
+
+    python tools/commandBenchmark.py [revision]
+
+revision is a git revision to time instead of the working tree, e.g.
+24d3097~1 for dispatch before verbs were looked up in GRAMMAR.
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sourceTree import sourceTree
+
+# Commands run each round. The last two miss, so their handlers run
+# their lookup and write nothing.
+COMMANDS = [
+    'get-button 1',
+    'get-due-date 1',
+    'get-card-content 1',
+    'where',
+    'set-due-date 1 -1',
+    'rename-card 1 "card"',
+    'delete-button 99',
+    'delete-card 9999',
+]
+
+ROUNDS = 20000
+
+
+def main(revision):
+    with sourceTree(revision) as path:
+        sys.path.insert(0, path)
+        from database import Database
+
+        db = Database(':memory:')
+        db.runCommand('add-card "card":"":-1 to 1')
+        db.runCommand('add-button "button" "delete-card $CARD"')
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for cmd in COMMANDS:
+                db.runCommand(cmd)
+        elapsed = time.perf_counter() - start
+        db.db.close()
+
+    count = ROUNDS * len(COMMANDS)
+    print(f'{revision or "working tree"}: {count} commands in'
+          f' {elapsed:.2f}s, {count / elapsed:,.0f} commands/s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else None))
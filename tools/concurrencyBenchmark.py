@@ -0,0 +1,126 @@
+'''
+One process adding cards while other processes read the same database
+file, for DURATION seconds, under each connection profile. Reports the
+writes and reads per second and the 'database is locked' errors seen.
+
+    python tools/concurrencyBenchmark.py [revision]
+
+revision is a git revision to run instead of the working tree, e.g.
+8e1c0d0~1 for the default rollback journal used before profiles. Exits
+non-zero when a process saw a locked database.
+'''
+import contextlib
+import inspect
+import io
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sourceTree import sourceTree
+
+# Seconds each run lasts
+DURATION = 3.0
+
+# Reader processes of each run
+READER_COUNTS = (1, 4)
+
+# Profiles the writer runs under, the readers open the file 'readonly'
+WRITER_PROFILES = ('safe', 'fast')
+
+# Cards in list 1 before a run starts
+START_CARDS = 500
+
+
+def openDatabase(path, filename, profile):
+    '''
+    Database on filename from the sources at path. profile None is for
+    revisions without profiles.
+    '''
+    sys.path.insert(0, path)
+    from database import Database
+    with contextlib.redirect_stdout(io.StringIO()):
+        if profile is None:
+            return Database(filename)
+        return Database(filename, profile=profile)
+
+
+def hasProfiles(path):
+    sys.path.insert(0, path)
+    from database import Database
+    return 'profile' in inspect.signature(Database).parameters
+
+
+def run(path, filename, profile, cmd, results):
+    '''
+    Runs cmd for DURATION seconds and puts (cmd, runs, errors) on results
+    '''
+    db = openDatabase(path, filename, profile)
+    runs = errors = 0
+    end = time.monotonic() + DURATION
+    while time.monotonic() < end:
+        try:
+            db.runCommand(cmd)
+            runs += 1
+        except sqlite3.OperationalError:
+            errors += 1
+    results.put((cmd, runs, errors))
+    return
+
+
+def benchmark(path, scratch, writerProfile, readerProfile, readers):
+    '''
+    writes/s, reads/s and errors of one run on a new database file
+    '''
+    filename = os.path.join(scratch, f'{writerProfile}-{readers}.db')
+    db = openDatabase(path, filename, writerProfile)
+    for _ in range(START_CARDS):
+        db.runCommand('add-card "card":"":-1 to 1')
+    db.db.close()
+
+    results = multiprocessing.Queue()
+    jobs = [(writerProfile, 'add-card "card":"":-1 to 1')]
+    jobs += [(readerProfile, 'show-lists 1')] * readers
+    processes = [
+        multiprocessing.Process(
+            target=run, args=(path, filename, profile, cmd, results))
+        for profile, cmd in jobs]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    writes = sum(runs for cmd, runs, _ in outcomes if cmd.startswith('add'))
+    reads = sum(runs for cmd, runs, _ in outcomes if cmd.startswith('show'))
+    errors = sum(errors for _, _, errors in outcomes)
+    return writes / DURATION, reads / DURATION, errors
+
+
+def main(revision):
+    failed = False
+    with sourceTree(revision) as path, \
+            tempfile.TemporaryDirectory() as scratch:
+        if hasProfiles(path):
+            profiles = [(profile, 'readonly') for profile in WRITER_PROFILES]
+        else:
+            profiles = [(None, None)]
+
+        print(revision or 'working tree')
+        for readers in READER_COUNTS:
+            for writerProfile, readerProfile in profiles:
+                writes, reads, errors = benchmark(
+                    path, scratch, writerProfile, readerProfile, readers)
+                failed = failed or errors > 0
+                name = writerProfile or 'default journal'
+                print(f'{name:16} {readers} readers: {writes:6.0f} writes/s'
+                      f' {reads:6.0f} reads/s, {errors} locked')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else None))
@@ -0,0 +1,230 @@
+'''
+Runs a series of user actions through the GUI models, the worker thread
+and the refresh scheduler, and counts the full reloads each one costs:
+card list reads, sidebar rebuilds, board list reads and button rows
+built. After every action the models are checked against the database.
+
+    python tools/modelRefreshBenchmark.py [--lazy]
+
+--lazy shows the cards with LazyCardModel instead of CardModel. Needs
+PySide2; no window is shown. Exits non-zero when a model does not match
+the database.
+'''
+import collections
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'main', 'python'))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PySide2.QtWidgets import QApplication
+from PySide2.QtCore import QModelIndex, QObject, Qt, Slot
+
+import center
+import sidebar
+from buttonTray import ButtonTray
+from center import CardModel, LazyCardModel
+from database import Database
+from refresh import RefreshScheduler
+from sidebar import SidebarModel
+from worker import DatabaseWorker
+
+CARDS_PER_LIST = 50
+BUTTONS = 10
+
+# Longest an action may take to land, in seconds
+SETTLE_TIMEOUT = 10
+
+# Reload counts by name, bumped by the wrappers count() puts in place
+counts = collections.Counter()
+
+
+def count(owner, name, key):
+    '''
+    Wraps owner.name so every call bumps counts[key]
+    '''
+    method = getattr(owner, name)
+
+    def counted(*args, **kwargs):
+        counts[key] += 1
+        return method(*args, **kwargs)
+
+    setattr(owner, name, counted)
+    return
+
+
+class Settler(QObject):
+    '''
+    Waits for every job submitted so far to land and for the reloads it
+    set off to run
+    '''
+    def __init__(self, app, worker, refresher):
+        QObject.__init__(self)
+        self.app = app
+        self.worker = worker
+        self.refresher = refresher
+        self.landed = set()
+        worker.resultReady.connect(self.onResultReady)
+        return
+
+    @Slot(object)
+    def onResultReady(self, future):
+        self.landed.add(future)
+        return
+
+    def settle(self):
+        # Jobs run in order, so the last one landing means all of them did
+        barrier = self.worker.call('connectionSettings')
+        deadline = time.monotonic() + SETTLE_TIMEOUT
+        while barrier not in self.landed or self.refresher.dirty:
+            if time.monotonic() > deadline:
+                raise TimeoutError('the worker did not catch up')
+            self.app.processEvents()
+        self.landed.clear()
+        return
+
+
+def seed(filename):
+    db = Database(filename)
+    with db.batch():
+        for listId in db.listsInBoard(1):
+            for i in range(CARDS_PER_LIST):
+                db.insertCard(f'card {listId}.{i}', listId)
+        for i in range(BUTTONS):
+            db.insertButton(f'button {i}', 'set-due-in $CARD 1w')
+    db.close()
+    return
+
+
+def mismatches(db, cardModel, sidebarModel, tray):
+    '''
+    What the models show that the database does not have
+    '''
+    found = []
+    cards = list(reversed(db.cardsInList(cardModel.listId)))
+    if isinstance(cardModel, CardModel) and \
+            cardModel.rowCount() != len(cards):
+        found.append('card list: wrong number of cards')
+    for row in range(min(cardModel.rowCount(), len(cards))):
+        index = cardModel.index(row, 0)
+        text = cardModel.data(index, Qt.DisplayRole)
+        if cardModel.rowidFromIndex(index) != cards[row].id or \
+                not text.startswith(cards[row].title):
+            found.append(f'card list: row {row} is not card {cards[row].id}')
+            break
+
+    boards = db.allBoards()
+    root = sidebarModel.invisibleRootItem()
+    shown = [(root.child(row).rowid, root.child(row).name)
+             for row in range(root.rowCount())]
+    if shown != [(board.id, board.title) for board in boards]:
+        found.append('sidebar: boards differ')
+    for row in range(root.rowCount()):
+        board = root.child(row)
+        if not board.loaded:
+            continue
+        listIds = db.listsInBoard(board.rowid)
+        titles = db.titles('lists', listIds)
+        shown = [(board.child(i).rowid, board.child(i).name)
+                 for i in range(board.rowCount())]
+        if shown != [(listId, titles[listId]) for listId in listIds]:
+            found.append(f'sidebar: lists of board {board.rowid} differ')
+
+    shown = [(buttonId, buttonRow.buttonTitle)
+             for buttonId, buttonRow in tray.buttonRows.items()]
+    if shown != [(button.id, button.name) for button in db.allButtons()]:
+        found.append('button tray: buttons differ')
+    return found
+
+
+def main(lazy):
+    app = QApplication([])
+    with tempfile.TemporaryDirectory() as scratch:
+        filename = os.path.join(scratch, 'models.db')
+        seed(filename)
+        db = Database(filename)
+        worker = DatabaseWorker(filename)
+        refresher = RefreshScheduler()
+        settler = Settler(app, worker, refresher)
+
+        count(center, 'getCardRows', 'card list reads')
+        count(LazyCardModel, 'clearRows', 'card list reads')
+        count(sidebar, 'getBoards', 'sidebar rebuilds')
+        count(SidebarModel, 'loadLists', 'board list reads')
+        count(ButtonTray, 'makeButtonRow', 'button rows built')
+
+        Model = LazyCardModel if lazy else CardModel
+        cardModel = Model(db, worker, refresher)
+        sidebarModel = SidebarModel(db, worker, refresher)
+        tray = ButtonTray(db, worker, refresher)
+        selected = []
+        tray.getCurrentList.connect(cardModel.currentList)
+        tray.getSelectedCards.connect(lambda cardIds: cardIds.extend(selected))
+        cardModel.showListCards(1)
+        for row in range(sidebarModel.rowCount()):
+            sidebarModel.fetchMore(sidebarModel.index(row, 0))
+        settler.settle()
+
+        def cardMime(row):
+            return cardModel.mimeData([cardModel.index(row, 0)])
+
+        def listIndex(listId):
+            return sidebarModel.findItem('LIST', listId).index()
+
+        def cardIds(rows):
+            return [cardModel.rowidFromIndex(cardModel.index(row, 0))
+                    for row in range(rows)]
+
+        def runButton():
+            selected[:] = cardIds(3)
+            tray.handleActionButton(list(tray.buttonRows)[1])
+            return
+
+        def editCard():
+            cardId = cardIds(1)[0]
+            cardModel.onCardEdited('edited', 'content', -1, cardId)
+            return
+
+        actions = [
+            ('edit a card', editCard),
+            ('drag a card within the list', lambda: cardModel.dropMimeData(
+                cardMime(0), Qt.MoveAction, 10, 0, QModelIndex())),
+            ('add a card', lambda: cardModel.addCard('new card', 1)),
+            ('drop a card on another list', lambda: sidebarModel.dropMimeData(
+                cardMime(0), Qt.MoveAction, -1, -1, listIndex(2))),
+            ('run a button on 3 cards', runButton),
+            ('rename a list', lambda: sidebarModel.onRenameList('renamed', 3)),
+            ('add a list', lambda: sidebarModel.onAddList('new list', 1)),
+            ('delete another list', lambda: sidebarModel.onDeleteList(2)),
+            ('add a board', lambda: sidebarModel.onAddBoard('new board')),
+            ('edit a button', lambda: tray.handleEditChanges(
+                'renamed', 'set-due-in $CARD 2w', list(tray.buttonRows)[2])),
+        ]
+
+        keys = ['card list reads', 'sidebar rebuilds', 'board list reads',
+                'button rows built']
+        print(Model.__name__)
+        print(f'{"action":30}' + ''.join(f'{key:>19}' for key in keys))
+        total = collections.Counter()
+        failed = False
+        for name, action in actions:
+            counts.clear()
+            action()
+            settler.settle()
+            total.update(counts)
+            print(f'{name:30}' + ''.join(f'{counts[key]:19}' for key in keys))
+            for problem in mismatches(db, cardModel, sidebarModel, tray):
+                print(f'    {problem}')
+                failed = True
+        print(f'{"total":30}' + ''.join(f'{total[key]:19}' for key in keys))
+
+        worker.close()
+        db.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main('--lazy' in sys.argv[1:]))
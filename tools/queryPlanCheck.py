@@ -0,0 +1,168 @@
+'''
+Runs every command in Database.actions on a fresh database and checks
+the EXPLAIN QUERY PLAN of each statement it ran: boards, lists, cards and
+buttons must be searched through an index, never scanned in full. Verbs
+that go over a whole table on purpose may, but only in index order.
+
+    python tools/queryPlanCheck.py
+
+A fresh database goes through every migration, so this also checks the
+indexes the table rebuild of migration 6 recreates. Exits non-zero when a
+statement scans a table its verb is not allowed to, scans one without an
+index, or when a verb has no sample command below.
+'''
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'main', 'python'))
+
+from database import Database
+
+# Tables that must be searched through an index
+INDEXED_TABLES = ('boards', 'lists', 'cards', 'buttons')
+
+# A sample of each verb, in an order that leaves the rows later samples
+# need. $DIR is a scratch directory.
+SAMPLES = [
+    'where',
+    'goto 2',
+    'add-card "new":"content":-1 to 4',
+    'add-list "new" to 2',
+    'add-board "new"',
+    'add-button "new" "delete-card $CARD"',
+    'set-card-content 5 "words"',
+    'get-card-content 5',
+    'set-due-date 5 1700000000',
+    'get-due-date 5',
+    'set-due-in 6 2w',
+    'move-due-cards 4,5 to 5',
+    'set-due-rule "move-card $CARD to next"',
+    'get-due-rule',
+    'run-due-cards',
+    'show-cards 4',
+    'show-lists 2',
+    'show-boards',
+    'show-tree',
+    'show-buttons',
+    'get-button 1',
+    'rename-button 1 "renamed" "delete-card $CARD"',
+    'rename-board 2 "renamed"',
+    'rename-list 4 "renamed"',
+    'rename-card 5 "renamed"',
+    'move-card 5 to 6',
+    'move-card 6 to next',
+    'move-list 4 to 1',
+    'shift-card 7 to 0',
+    'shift-list 5 to 0',
+    'shift-board 2 to 0',
+    'search-cards "card"',
+    'show-settings',
+    'show-statement-cache',
+    'stats',
+    'export "$DIR/export.jsonl"',
+    'import "$DIR/export.jsonl"',
+    'reindex',
+    'repair-orphans',
+    'delete-card 8',
+    'delete-list 6',
+    'delete-button 1',
+    'delete-board 2',
+]
+
+# Tables each verb goes over in full on purpose
+ALLOWED_SCANS = {
+    # The board order every command resolves board positions with
+    'where': {'boards'},
+    'show-boards': {'boards'},
+    'show-buttons': {'buttons'},
+    # Card counts of every list, in one pass over cardsByList
+    'show-tree': {'boards', 'cards'},
+    # Boards have no parent, all of them are siblings of the one moved
+    'shift-board': {'boards'},
+    'export': {'boards', 'lists', 'cards', 'buttons'},
+    'reindex': {'boards', 'lists', 'cards', 'buttons'},
+}
+
+
+def seed(db):
+    '''
+    A second board with two lists of cards, on top of the default board
+    '''
+    with db.batch():
+        boardId = db.insertBoard('board')
+        for listNum in range(2):
+            listId = db.insertList(f'list {listNum}', boardId)
+            for cardNum in range(20):
+                db.insertCard(f'card {cardNum}', listId, 'content')
+    return
+
+
+def tracedStatements(db, cmd):
+    '''
+    Runs cmd and returns the statements it ran, with their values bound
+    '''
+    statements = []
+
+    def onStatement(sql):
+        # Statements of virtual tables and triggers are not the command's
+        if not sql.startswith('--') and sql not in statements:
+            statements.append(sql)
+        return
+
+    db.db.set_trace_callback(onStatement)
+    try:
+        db.runCommand(cmd)
+    finally:
+        db.db.set_trace_callback(None)
+    return statements
+
+
+def scans(db, sql):
+    '''
+    (table, detail) of each step of the plan of sql that scans a table
+    of INDEXED_TABLES in full
+    '''
+    if not sql.lstrip().upper().startswith(
+            ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')):
+        return []
+    steps = []
+    for row in db.db.execute(f'EXPLAIN QUERY PLAN {sql}'):
+        detail = row[3]
+        words = detail.split()
+        if words[0] == 'SCAN' and words[1] in INDEXED_TABLES:
+            steps.append((words[1], detail))
+    return steps
+
+
+def main():
+    failed = False
+    with tempfile.TemporaryDirectory() as scratch:
+        db = Database(os.path.join(scratch, 'plans.db'), stats=True)
+        seed(db)
+
+        sampled = {cmd.split(' ', 1)[0] for cmd in SAMPLES}
+        for verb in sorted(set(db.actions) - sampled):
+            print(f'{verb}: no sample command')
+            failed = True
+
+        for cmd in SAMPLES:
+            verb = cmd.split(' ', 1)[0]
+            cmd = cmd.replace('$DIR', scratch)
+            allowed = ALLOWED_SCANS.get(verb, set())
+            for sql in tracedStatements(db, cmd):
+                for table, detail in scans(db, sql):
+                    if table in allowed and 'INDEX' in detail:
+                        continue
+                    text = ' '.join(sql.split())
+                    print(f'{verb}: {detail}: {text}')
+                    failed = True
+        db.close()
+
+    print('FAILED' if failed else f'{len(SAMPLES)} commands, no full scans')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
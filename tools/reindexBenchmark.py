@@ -0,0 +1,98 @@
+'''
+Times renumbering one shuffled list of LIST_SIZES cards with
+Database.reindex, on an in-memory database, then the reindex command
+over REINDEX_CARDS cards spread over REINDEX_LISTS lists.
+
+    python tools/reindexBenchmark.py [revision]
+
+revision is a git revision to time instead of the working tree, e.g.
+55a5691~1 for the UPDATE per row reindex used to run. Revisions without
+the reindex command only time the lists. Exits non-zero when a list
+does not come out numbered 0, IDX_GAP, 2 * IDX_GAP and so on.
+'''
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sourceTree import sourceTree
+
+# Cards in the list renumbered, one run each
+LIST_SIZES = (1000, 10000, 100000)
+
+REINDEX_CARDS = 100000
+REINDEX_LISTS = 50
+
+SEED = 0
+
+
+def openDatabase(Database):
+    '''
+    A fresh in-memory Database, without the line it prints on creating
+    a database
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Database(':memory:')
+
+
+def fill(db, listIds, count, rand):
+    '''
+    count cards spread over listIds, idx values shuffled
+    '''
+    idxs = list(range(count))
+    rand.shuffle(idxs)
+    sql = '''
+        INSERT INTO cards(title, idx, dueDate, list, content)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    db.db.executemany(sql, (
+        (f'card {i}', idx, -1, listIds[i % len(listIds)], '')
+        for i, idx in enumerate(idxs)))
+    db.db.commit()
+    return
+
+
+def main(revision):
+    rand = random.Random(SEED)
+    failed = False
+    with sourceTree(revision) as path:
+        sys.path.insert(0, path)
+        from database import Database, IDX_GAP
+
+        print(revision or 'working tree')
+        for size in LIST_SIZES:
+            db = openDatabase(Database)
+            fill(db, [1], size, rand)
+            start = time.perf_counter()
+            db.reindex('cards', 'list', 1)
+            db.db.commit()
+            elapsed = time.perf_counter() - start
+            sql = 'SELECT idx FROM cards WHERE list = 1 ORDER BY idx'
+            idxs = [row[0] for row in db.db.execute(sql)]
+            wrong = idxs != [i * IDX_GAP for i in range(size)]
+            failed = failed or wrong
+            print(f'{size:>8} cards in one list: {elapsed * 1000:8.1f} ms'
+                  f'{"  WRONG" if wrong else ""}')
+            db.db.close()
+
+        db = openDatabase(Database)
+        if 'reindex' in db.actions:
+            sql = 'INSERT INTO lists(title, idx, board) VALUES (?, ?, 1)'
+            listIds = [db.db.execute(sql, (f'list {i}', i)).lastrowid
+                       for i in range(REINDEX_LISTS)]
+            fill(db, listIds, REINDEX_CARDS, rand)
+            start = time.perf_counter()
+            db.runCommand('reindex')
+            elapsed = time.perf_counter() - start
+            print(f'{"reindex":>8} {REINDEX_CARDS} cards in {REINDEX_LISTS}'
+                  f' lists: {elapsed * 1000:8.1f} ms')
+        db.db.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else None))
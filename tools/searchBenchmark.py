@@ -0,0 +1,163 @@
+'''
+Times search-cards on a 1M-card database, checks that paging through
+the results visits each card once and that a search with at most
+SEARCH_RANK_WINDOW matches ranks all of them.
+
+    python tools/searchBenchmark.py [fixture.db]
+
+The fixture is built on the first run (about 90 s) from a fixed seed, so
+every run searches the same cards. Exits non-zero when a query takes
+SEARCH_BUDGET_MS or longer, a page repeats a card or a first page is not
+the best matches.
+'''
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'main', 'python'))
+
+from database import (
+    Database, SEARCH_PAGE_SIZE, SEARCH_RANK_WINDOW, searchQuery)
+
+FIXTURE_CARDS = 1000000
+FIXTURE_LISTS = 100
+FIXTURE_SEED = 0
+
+# Slowest a search may be, in ms
+SEARCH_BUDGET_MS = 100
+
+# (query, page) pairs timed, from a handful of matches to all of them
+QUERIES = [
+    ('w12345', 1),
+    ('w123', 1),
+    ('meeting w77', 1),
+    ('fix', 1),
+    ('fix', 20),
+    ('w1', 1),
+    ('w1', 10000),
+    ('email w', 1),
+    ('w12345 w1', 1),
+]
+
+# Queries paged through from the start, pages read of each
+PAGED_QUERIES = [('w12', 120), ('w1', 60)]
+
+# Queries whose first page is checked against ranking every match, with
+# fewer and with more matches than SEARCH_RANK_WINDOW
+RANKED_QUERIES = ['w12345', 'w123 w1', 'w1 w2', 'meeting w77', 'fix w12']
+
+
+def buildFixture(path):
+    '''
+    FIXTURE_CARDS cards spread over FIXTURE_LISTS lists. Titles are a
+    common word and two of 20k rare ones, contents eight rare words.
+    '''
+    db = Database(path, profile='fast')
+    rand = random.Random(FIXTURE_SEED)
+    words = [f'w{i}' for i in range(20000)]
+    common = ['meeting', 'email', 'fix', 'buy', 'call', 'review', 'plan',
+              'write']
+
+    def cards(listIds):
+        for i in range(FIXTURE_CARDS):
+            title = (f'{rand.choice(common)} {rand.choice(words)}'
+                     f' {rand.choice(words)}')
+            content = ' '.join(rand.choices(words, k=8))
+            yield (title, i * 1024, -1, listIds[i % len(listIds)], content)
+
+    start = time.perf_counter()
+    with db.batch():
+        listIds = [db.insertList(f'L{i}', 1) for i in range(FIXTURE_LISTS)]
+        sql = '''
+            INSERT INTO cards(title, idx, dueDate, list, content)
+            VALUES (?, ?, ?, ?, ?)
+        '''
+        db.db.executemany(sql, cards(listIds))
+    print(f'Built {FIXTURE_CARDS} cards in {time.perf_counter() - start:.0f}s')
+    db.close()
+    return
+
+
+def timeQuery(db, text, page, runs=5):
+    '''
+    Best of runs, in ms, of one page of search-cards
+    '''
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        db.runCommand(f'search-cards "{text}" page {page}')
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def pageThrough(db, text, pages):
+    '''
+    Reads pages of text the way SearchModel.fetchMore does and returns
+    the card ids seen, in order
+    '''
+    cardIds = []
+    for _ in range(pages):
+        rows = db.searchCards(text, SEARCH_PAGE_SIZE, len(cardIds))
+        cardIds += [row.cardId for row in rows]
+        if len(rows) < SEARCH_PAGE_SIZE:
+            break
+    return cardIds
+
+
+def bestMatches(db, text):
+    '''
+    Card ids of the first page of text with every match ranked
+    '''
+    sql = '''
+        SELECT rowid
+        FROM cardsSearch
+        WHERE cardsSearch MATCH ?
+        ORDER BY rank, rowid DESC
+        LIMIT ?
+    '''
+    rows = db.execute(sql, (searchQuery(text), SEARCH_PAGE_SIZE))
+    return [row[0] for row in rows]
+
+
+def main(path):
+    if not os.path.exists(path):
+        buildFixture(path)
+    db = Database(path, profile='fast')
+    failed = False
+
+    for text, page in QUERIES:
+        sql = 'SELECT count(*) FROM cardsSearch WHERE cardsSearch MATCH ?'
+        matches = db.execute(sql, (searchQuery(text),)).fetchone()[0]
+        elapsed = timeQuery(db, text, page)
+        slow = elapsed >= SEARCH_BUDGET_MS
+        failed = failed or slow
+        print(f'{text!r:14} page {page:5}: {elapsed:6.1f} ms'
+              f'  {matches:7} matches{"  SLOW" if slow else ""}')
+
+    for text, pages in PAGED_QUERIES:
+        cardIds = pageThrough(db, text, pages)
+        repeated = len(cardIds) - len(set(cardIds))
+        failed = failed or repeated > 0
+        print(f'{text!r:14} {len(cardIds)} rows paged, {repeated} repeated')
+
+    for text in RANKED_QUERIES:
+        windowed = db.searchIsWindowed(text)
+        cardIds = [row.cardId for row in db.searchCards(text)]
+        ranked = cardIds == bestMatches(db, text)
+        # Past SEARCH_RANK_WINDOW matches the first page only has to be
+        # the best of the newest window, and the UI says so
+        wrong = not ranked and not windowed
+        failed = failed or wrong
+        order = 'windowed' if windowed else 'ranked'
+        print(f'{text!r:14} {order}, first page best overall: {ranked}'
+              f'{"  WRONG" if wrong else ""}')
+
+    db.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else 'search1m.db'))
@@ -0,0 +1,38 @@
+'''
+The Python sources of the app at a git revision, for the benchmarks that
+time a change against the code before it:
+
+    with sourceTree('24d3097~1') as path:
+        sys.path.insert(0, path)
+        import database
+'''
+import contextlib
+import io
+import os
+import subprocess
+import tarfile
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Where the sources live, relative to ROOT
+SOURCE_DIR = 'src/main/python'
+
+
+@contextlib.contextmanager
+def sourceTree(revision=None):
+    '''
+    Path of SOURCE_DIR as of revision, extracted to a scratch directory
+    removed after the block. None is the working tree as it is.
+    '''
+    if revision is None:
+        yield os.path.join(ROOT, SOURCE_DIR)
+        return
+    archive = subprocess.run(
+        ['git', '-C', ROOT, 'archive', '--format=tar', revision, SOURCE_DIR],
+        check=True, capture_output=True).stdout
+    with tempfile.TemporaryDirectory() as scratch:
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(scratch)
+        yield os.path.join(scratch, SOURCE_DIR)
+    return